@@ -1,5 +1,9 @@
+import functools
+import itertools
+import math
 import yaml
 import gmpy2
+import numpy as np
 
 with open('R27.yml') as f:
     basic_cipher = yaml.safe_load(f)
@@ -24,157 +28,429 @@ def item_recursive(index, tree):
         item = item[i]
     return item
 
+def leaves(tree, index=()):
+    for i, node in enumerate(tree):
+        if len(node) > 1:
+            yield from leaves(node, (i,) + index)
+        else:
+            yield node, (i,) + index
+
+# Flattened form of `basic_cipher`. Each symbol is identified with its value
+# 9*t[2] + 3*t[1] + t[0], where t is its index as returned by
+# `index_recursive`; this is also its digit value in `as_integer`.
+value_trits = np.zeros((27, 3), dtype=np.uint8)
+value_codes = np.zeros(27, dtype=np.uint8)
+for symbol, index in leaves(basic_cipher):
+    value = 9*index[2] + 3*index[1] + index[0]
+    value_trits[value] = index
+    value_codes[value] = ord(symbol)
+
+# Map character codes to symbol values. Anything that is not an uppercase
+# letter is treated as '+'. The last entry catches all non-Latin-1 codes.
+code_values = np.full(257, value_codes.tolist().index(ord('+')), dtype=np.uint8)
+code_values[value_codes] = np.arange(27, dtype=np.uint8)
+
+def demux_values(text):
+    '''
+    Convert a string to an array of symbol values (0 to 26), one per character.
+    '''
+    codes = np.frombuffer(text.upper().encode('utf-32-le'), dtype=np.uint32)
+    return code_values[np.minimum(codes, 256)]
+
+def mux_values(values):
+    '''
+    Convert an array of symbol values back to a string.
+    '''
+    return value_codes[np.asarray(values)].tobytes().decode('ascii')
+
+def demux_array(text):
+    '''
+    Convert a string to a flat uint8 array of trits, in the same order as
+    `demux`.
+    '''
+    return value_trits[demux_values(text)].ravel()
+
+def mux_array(trits):
+    '''
+    Convert a flat array of trits, three per character, back to a string.
+    '''
+    trits = np.asarray(trits, dtype=np.uint8).reshape(-1, 3)
+    return mux_values(9*trits[:, 2] + 3*trits[:, 1] + trits[:, 0])
+
 def mux(indices):
     assert(len(indices) % 3 == 0)
-    
-    text = ""
-    for j in range(len(indices) // 3):
-        index = indices[3*j:3*(j+1)]
-        text += item_recursive(index, basic_cipher)
-    return text
+    return mux_array(indices)
 
 def demux(text):
-    text = text.upper()
-    indices = []
-    for c in text:
-        if c not in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
-            c = '+'
-        indices.extend(index_recursive(c, basic_cipher))
-    return indices
+    return demux_array(text).tolist()
 
-def compress(plaintext):
-    plaintext = plaintext.upper()
-    indices = []
-    for c in plaintext:
-        if c not in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
-            c = '+'
-        index = index_recursive(c, compressed_cipher)[::-1]
-        indices.extend(index)
+# Canonical tables for the prefix code in `compressed_cipher`. Each symbol
+# value is encoded as the path from the root to its leaf, padded out to
+# `code_length` trits and masked by `compress_mask`. Decoding peeks at the
+# next `code_length` trits (as a base-3 number, most significant first) and
+# looks up the symbol and the number of trits it actually uses.
+code_paths = {code_values[ord(symbol)]: index[::-1]
+              for symbol, index in leaves(compressed_cipher)}
+code_length = max(len(path) for path in code_paths.values())
+compress_trits = np.zeros((27, code_length), dtype=np.uint8)
+compress_mask = np.zeros((27, code_length), dtype=bool)
+decompress_values = np.zeros(3**code_length, dtype=np.uint8)
+decompress_lengths = np.zeros(3**code_length, dtype=np.intp)
+for value, path in code_paths.items():
+    compress_trits[value, :len(path)] = path
+    compress_mask[value, :len(path)] = True
+    prefix = 0
+    for trit in path:
+        prefix = 3*prefix + trit
+    span = 3**(code_length - len(path))
+    decompress_values[prefix*span:(prefix + 1)*span] = value
+    decompress_lengths[prefix*span:(prefix + 1)*span] = len(path)
+
+def compress_array(values):
+    '''
+    Encode an array of symbol values with the compression code, returning
+    the concatenated codewords as a flat array of trits.
+    '''
+    return compress_trits[values][compress_mask[values]]
+
+def decompress_array(trits):
+    '''
+    Decode as many complete codewords as possible from a flat array of trits.
+    Returns the decoded symbol values and the number of trits consumed;
+    anything after that is an incomplete codeword.
+    '''
+    n = len(trits)
+    padded = np.zeros(n + code_length - 1, dtype=np.intp)
+    padded[:n] = trits
+    windows = np.zeros(n, dtype=np.intp)
+    for j in range(code_length):
+        windows = 3*windows + padded[j:j+n]
+    lengths = decompress_lengths[windows].tolist()
     
+    starts = []
+    i = 0
+    while i < n and i + lengths[i] <= n:
+        starts.append(i)
+        i += lengths[i]
+    return decompress_values[windows[starts]], i
+
+def compress(plaintext):
+    indices = compress_array(demux_values(plaintext))
     extend_by = {0: 0, 1: 2, 2: 1}[len(indices) % 3]
-    indices.extend([0]*extend_by)
-    ciphertext = mux(indices)
-    
-    return ciphertext
+    indices = np.concatenate([indices, np.zeros(extend_by, dtype=np.uint8)])
+    return mux_array(indices)
 
 def decompress(ciphertext):
-    indices = demux(ciphertext)
-    
-    node = compressed_cipher
-    plaintext_chars = []
-    while len(indices) > 0:
-        if len(node) > 1:
-            node = node[indices[0]]
-            indices.pop(0)
-        else:
-            plaintext_chars.append(node)
-            node = compressed_cipher
-    if len(node) == 1:
-        plaintext_chars.append(node)
-    plaintext = ''.join(plaintext_chars)
-    
-    return plaintext
+    values, used = decompress_array(demux_array(ciphertext))
+    return mux_values(values)
+
+def compress_iter(chunks):
+    '''
+    Compress an iterable of plaintext chunks, yielding ciphertext chunks.
+    The concatenated output is the same as `compress` of the concatenated
+    input, but at most two trits are held over between chunks.
+    '''
+    leftover = np.zeros(0, dtype=np.uint8)
+    for chunk in chunks:
+        indices = np.concatenate([leftover, compress_array(demux_values(chunk))])
+        cut = len(indices) - len(indices) % 3
+        leftover = indices[cut:]
+        yield mux_array(indices[:cut])
+    if len(leftover) > 0:
+        extend_by = {1: 2, 2: 1}[len(leftover)]
+        yield mux_array(np.concatenate([leftover, np.zeros(extend_by, dtype=np.uint8)]))
+
+def decompress_iter(chunks):
+    '''
+    Decompress an iterable of ciphertext chunks, yielding plaintext chunks.
+    Incomplete codewords at the end of a chunk are carried into the next one.
+    '''
+    leftover = np.zeros(0, dtype=np.uint8)
+    for chunk in chunks:
+        indices = np.concatenate([leftover, demux_array(chunk)])
+        values, used = decompress_array(indices)
+        leftover = indices[used:]
+        yield mux_values(values)
+
+def read_chunks(f, chunk_size=2**16):
+    return iter(lambda: f.read(chunk_size), '')
+
+def compress_stream(infile, outfile, chunk_size=2**16):
+    for chunk in compress_iter(read_chunks(infile, chunk_size)):
+        outfile.write(chunk)
+
+def decompress_stream(infile, outfile, chunk_size=2**16):
+    for chunk in decompress_iter(read_chunks(infile, chunk_size)):
+        outfile.write(chunk)
+
+def trifid_mix_array(indices):
+    '''
+    Trifid-mix an array of trits. The last axis holds the trits of one
+    message, so a 2-D array mixes a batch of same-length messages at once.
+    '''
+    indices = np.asarray(indices)
+    n = indices.shape[-1] // 3
+    shape = indices.shape[:-1]
+    return indices.reshape(shape + (n, 3)).swapaxes(-1, -2).reshape(shape + (3*n,))
+
+def trifid_unmix_array(indices):
+    '''
+    Undo `trifid_mix_array`.
+    '''
+    indices = np.asarray(indices)
+    n = indices.shape[-1] // 3
+    shape = indices.shape[:-1]
+    return indices.reshape(shape + (3, n)).swapaxes(-1, -2).reshape(shape + (3*n,))
 
 def trifid_mix(plaintext):
-    indices = demux(plaintext)
-    indices_mixed = indices[0::3] + indices[1::3] + indices[2::3]
-    return mux(indices_mixed)
+    return mux_array(trifid_mix_array(demux_array(plaintext)))
 
 def trifid_unmix(ciphertext):
-    n = len(ciphertext)
-    indices = demux(ciphertext)
-    indices_unmixed = [0]*(3*n)
-    indices_unmixed[0::3] = indices[:n]
-    indices_unmixed[1::3] = indices[n:2*n]
-    indices_unmixed[2::3] = indices[2*n:3*n]
-    return mux(indices_unmixed)
+    return mux_array(trifid_unmix_array(demux_array(ciphertext)))
+
+def demux_values_many(texts):
+    '''
+    Convert a list of same-length messages to a 2-D array of symbol values,
+    one row per message.
+    '''
+    texts = list(texts)
+    if len(set(len(text) for text in texts)) > 1:
+        raise ValueError("Messages must all have the same length")
+    length = len(texts[0]) if len(texts) > 0 else 0
+    return demux_values(''.join(texts)).reshape(len(texts), length)
+
+def mux_values_many(values):
+    '''
+    Convert a 2-D array of symbol values back to a list of messages.
+    '''
+    text = mux_values(values)
+    length = values.shape[-1]
+    return [text[length*i:length*(i+1)] for i in range(values.shape[0])]
+
+def demux_many(texts):
+    '''
+    Convert a list of same-length messages to a 2-D array of trits, one row
+    per message.
+    '''
+    values = demux_values_many(texts)
+    return value_trits[values].reshape(values.shape[0], 3*values.shape[1])
+
+def mux_many(indices):
+    '''
+    Convert a 2-D array of trits back to a list of messages.
+    '''
+    text = mux_array(indices)
+    length = indices.shape[-1] // 3
+    return [text[length*i:length*(i+1)] for i in range(indices.shape[0])]
+
+def trifid_mix_many(texts):
+    '''
+    Trifid-mix a list of messages, which must all have the same length.
+    '''
+    return mux_many(trifid_mix_array(demux_many(texts)))
+
+def trifid_unmix_many(texts):
+    '''
+    Trifid-unmix a list of messages, which must all have the same length.
+    '''
+    return mux_many(trifid_unmix_array(demux_many(texts)))
+
+# Multiplication and inverse tables for the Heisenberg group mod 3, with each
+# symbol value standing for the element with trits (a, b, c) = value_trits.
+heisenberg_table = np.zeros((27, 27), dtype=np.uint8)
+heisenberg_inverse = np.zeros(27, dtype=np.uint8)
+for p, (p0, p1, p2) in enumerate(value_trits.tolist()):
+    heisenberg_inverse[p] = 9*(-p2 % 3) + 3*((p0*p2 - p1) % 3) + (-p0 % 3)
+    for k, (k0, k1, k2) in enumerate(value_trits.tolist()):
+        heisenberg_table[p, k] = (9*((p2 + k2) % 3)
+                                  + 3*((p1 + k1 + p0*k2) % 3)
+                                  + (p0 + k0) % 3)
+
+class HeisenbergKey:
+    __slots__ = 'values', 'inverse_values'
+    
+    def __init__(self, key):
+        self.values = demux_values(key)
+        if len(self.values) == 0:
+            raise ValueError("Key must not be empty")
+        self.inverse_values = heisenberg_inverse[self.values]
+    
+    def add_values(self, values):
+        key_values = np.resize(self.values, values.shape[-1])
+        return heisenberg_table[values, key_values]
+    
+    def subtract_values(self, values):
+        key_values = np.resize(self.inverse_values, values.shape[-1])
+        return heisenberg_table[values, key_values]
+    
+    def add(self, plaintext):
+        return mux_values(self.add_values(demux_values(plaintext)))
+    
+    def subtract(self, ciphertext):
+        return mux_values(self.subtract_values(demux_values(ciphertext)))
+    
+    def add_many(self, plaintexts):
+        return mux_values_many(self.add_values(demux_values_many(plaintexts)))
+    
+    def subtract_many(self, ciphertexts):
+        return mux_values_many(self.subtract_values(demux_values_many(ciphertexts)))
 
 def heisenberg_add(plaintext, key):
-    n = len(plaintext)
-    cipher_indices = []
-    for i in range(n):
-        plain_indices = demux(plaintext[i])
-        key_indices = demux(key[i % len(key)])
-        cipher_indices.extend([
-            (plain_indices[0] + key_indices[0]) % 3,
-            (plain_indices[1] + key_indices[1]
-             + plain_indices[0] * key_indices[2]) % 3,
-            (plain_indices[2] + key_indices[2]) % 3
-        ])
-    return mux(cipher_indices)
+    return HeisenbergKey(key).add(plaintext)
 
 def heisenberg_subtract(ciphertext, key):
-    n = len(ciphertext)
-    plain_indices = []
-    for i in range(n):
-        cipher_indices = demux(ciphertext[i])
-        key_indices = demux(key[i % len(key)])
-        key_indices = [
-            -key_indices[0] % 3,
-            (key_indices[0] * key_indices[2]
-             - key_indices[1]) % 3,
-            -key_indices[2] % 3
-        ]
-        plain_indices.extend([
-            (cipher_indices[0] + key_indices[0]) % 3,
-            (cipher_indices[1] + key_indices[1]
-             + cipher_indices[0] * key_indices[2]) % 3,
-            (cipher_indices[2] + key_indices[2]) % 3
-        ])
-    return mux(plain_indices)
+    return HeisenbergKey(key).subtract(ciphertext)
+
+# Digit characters used by gmpy2 for string conversion in bases up to 36
+# (which may come out in either case).
+digit_codes = np.frombuffer(b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ', dtype=np.uint8)
+code_digits = np.zeros(256, dtype=np.uint8)
+code_digits[digit_codes] = np.arange(36, dtype=np.uint8)
+code_digits[np.frombuffer(b'abcdefghijklmnopqrstuvwxyz', dtype=np.uint8)] = np.arange(10, 36, dtype=np.uint8)
+
+def word_size(base):
+    '''
+    Number of base-`base` digits that can be packed into a single int64.
+    '''
+    size = 1
+    while base**(size + 1) < 2**63:
+        size += 1
+    return size
+
+def integer_from_digits(digits, base):
+    '''
+    Read an array of digits in the given base, most significant first, as an
+    integer. Small bases go through GMP's string conversion. Otherwise,
+    digits are packed into machine words with NumPy (or, for bases too large
+    for a machine word, taken one per word as mpz), and the words are
+    combined pairwise by divide and conquer.
+    '''
+    if len(digits) == 0:
+        return gmpy2.mpz(0)
+    if base <= 36:
+        digits = np.asarray(digits, dtype=np.int64)
+        return gmpy2.mpz(digit_codes[digits].tobytes().decode('ascii'), base)
+    
+    if base < 2**63:
+        size = word_size(base)
+        digits = np.asarray(digits, dtype=np.int64)
+        digits = np.concatenate([np.zeros(-len(digits) % size, dtype=np.int64), digits])
+        digits = digits.reshape(-1, size)
+        words = np.zeros(len(digits), dtype=np.int64)
+        for j in range(size):
+            words = base*words + digits[:, j]
+        values = [gmpy2.mpz(word) for word in words.tolist()]
+    else:
+        size = 1
+        values = [gmpy2.mpz(int(digit)) for digit in digits]
+    
+    power = gmpy2.mpz(base)**size
+    while len(values) > 1:
+        if len(values) % 2 == 1:
+            values.insert(0, gmpy2.mpz(0))
+        values = [hi*power + lo for hi, lo in zip(values[0::2], values[1::2])]
+        power = power*power
+    return values[0]
+
+def integer_to_digits(z, base, length=None):
+    '''
+    Inverse of `integer_from_digits`, padded with zeros to at least `length`
+    digits. Large bases split `z` by repeated squares of a word-sized power
+    of the base, then unpack the words with NumPy. Bases too large for a
+    machine word give an object array of mpz digits.
+    '''
+    z = gmpy2.mpz(z)
+    dtype = np.int64 if base < 2**63 else object
+    if z == 0:
+        digits = np.zeros(0, dtype=dtype)
+    elif base <= 36:
+        codes = np.frombuffer(gmpy2.digits(z, base).encode('ascii'), dtype=np.uint8)
+        digits = code_digits[codes].astype(np.int64)
+    else:
+        size = word_size(base) if base < 2**63 else 1
+        powers = [gmpy2.mpz(base)**size]
+        while powers[-1] <= z:
+            powers.append(powers[-1]*powers[-1])
+        values = [z]
+        for power in powers[-2::-1]:
+            values = [part for value in values for part in gmpy2.f_divmod(value, power)]
+        
+        if base < 2**63:
+            words = np.array([int(value) for value in values], dtype=np.int64)
+            digits = np.zeros((len(words), size), dtype=np.int64)
+            for j in range(size - 1, -1, -1):
+                words, digits[:, j] = np.divmod(words, base)
+            digits = digits.ravel()
+        else:
+            digits = np.array(values, dtype=object)
+        digits = digits[np.argmax(digits != 0):]
+    if length is not None and len(digits) < length:
+        digits = np.concatenate([np.zeros(length - len(digits), dtype=dtype), digits])
+    return digits
+
+def repunit(base, length):
+    return (gmpy2.mpz(base)**length - 1) // (base - 1)
+
+def integer_from_bijective(digits, base):
+    '''
+    Read an array of bijective base-`base` digits (1 to `base`), most
+    significant first, as an integer. A k-digit bijective numeral is the
+    repunit of length k plus the ordinary numeral with every digit reduced
+    by one.
+    '''
+    digits = np.asarray(digits, dtype=np.int64 if base < 2**63 else object)
+    return integer_from_digits(digits - 1, base) + repunit(base, len(digits))
+
+def integer_to_bijective(z, base):
+    '''
+    Inverse of `integer_from_bijective`.
+    '''
+    z = gmpy2.mpz(z)
+    # The number of digits is the largest k with repunit(base, k) <= z,
+    # i.e. base**k <= (base - 1)*z + 1.
+    bound = (base - 1)*z + 1
+    length = max(int((bound.bit_length() - 1) / math.log2(base)), 0)
+    power = gmpy2.mpz(base)**length
+    while power > bound:
+        length -= 1
+        power //= base
+    while power*base <= bound:
+        length += 1
+        power *= base
+    return integer_to_digits(z - (power - 1) // (base - 1), base, length) + 1
 
 symbols = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ+'
 
 def frobnicate(text, modulus=2):
-    text = text.upper()
-    z = 0
-    for c in text:
-        if c not in symbols[:-1]:
-            c = '+'
-        z = 27*z + symbols.index(c) + 1
+    # Symbol values are already the bijective digits for A to Z; '+' is 27.
+    values = demux_values(text).astype(np.int64)
+    values[values == 0] = 27
+    z = integer_from_bijective(values, 27)
     
-    digits = []
-    while z > 0:
-        z_new = z//modulus - (1 if z % modulus == 0 else 0)
-        digits.append(z - modulus*z_new)
-        z = z_new
+    digits = integer_to_bijective(z, modulus)
+    z = integer_from_bijective(digits[::-1], modulus)
     
-    z = 0
-    for digit in digits:
-        z = modulus*z + digit
-    
-    digits = []
-    while z > 0:
-        z_new = z//27 - (1 if z % 27 == 0 else 0)
-        digits.append(z - 27*z_new)
-        z = z_new
-    return ''.join(symbols[digit - 1] for digit in digits[::-1])
+    digits = integer_to_bijective(z, 27)
+    return mux_values(digits % 27)
 
 def as_integer(text):
-    z = 0
-    for digit in demux(text)[::-1]:
-        z = 3*z + digit
-    return z
+    '''
+    Interpret a message as a base-27 integer, first character least
+    significant.
+    '''
+    return integer_from_digits(demux_values(text)[::-1], 27)
 
 def as_text(z, length=None):
-    digits = []
-    
-    i = 0
-    while z != 0 or (length is not None and i < 3*length):
-        z_new = z//3
-        digits.append(z - 3*z_new)
-        z = z_new
-        i += 1
-    
-    extend_by = {0: 0, 1: 2, 2: 1}[len(digits) % 3]
-    digits.extend([0]*extend_by)
-    return mux(digits)
+    '''
+    Inverse of `as_integer`, padded with '+' to at least `length` characters.
+    '''
+    return mux_values(integer_to_digits(z, 27, length)[::-1])
 
 def sum(text1, text2):
     length = max(len(text1), len(text2))
     z1, z2 = as_integer(text1), as_integer(text2)
     
-    z_out = z1 + z2 % 3**(3*length)
+    z_out = (z1 + z2) % gmpy2.mpz(3)**(3*length)
     
     return as_text(z_out, length)
 
@@ -182,7 +458,7 @@ def difference(text1, text2):
     length = max(len(text1), len(text2))
     z1, z2 = as_integer(text1), as_integer(text2)
     
-    z_out = z1 - z2 % 3**(3*length)
+    z_out = (z1 - z2) % gmpy2.mpz(3)**(3*length)
     
     return as_text(z_out, length)
 
@@ -190,7 +466,7 @@ def product(text, key):
     length = max(len(text), len(key))
     z_text, z_key = as_integer(text), as_integer(key)
     
-    z_out = z_text * z_key % 3**(3*length)
+    z_out = z_text * z_key % gmpy2.mpz(3)**(3*length)
     
     return as_text(z_out, length)
 
@@ -211,18 +487,18 @@ def euclid_gcd(a, b):
         coeff_smaller = next_coeff_smaller 
     return bigger, prev_coeff_bigger, prev_coeff_smaller
 
+def inverse_integer(z_key, length):
+    modulus = gmpy2.mpz(3)**(3*length)
+    assert(z_key < modulus)
+    assert(z_key % 3 != 0)
+    return gmpy2.invert(z_key, modulus)
+
+@functools.lru_cache(maxsize=1024)
 def inverse(key, length=None):
     if length is None:
-        length = len(key)    
+        length = len(key)
     z_key = as_integer(key)
-    
-    assert(z_key < 3**(3*length))
-    assert(z_key % 3 != 0)
-    gcd, coeff, inverse = euclid_gcd(z_key, 3**(3*length))
-    assert(gcd == 1)
-    inverse = inverse % 3**(3*length)
-    
-    return as_text(inverse, length)
+    return as_text(inverse_integer(z_key, length), length)
 
 def quotient(text, key):
     length = max(len(text), len(key))
@@ -230,58 +506,169 @@ def quotient(text, key):
     inverse_key = inverse(key, length)
     return product(text, inverse_key)
 
+def reverse_integer(z, length):
+    return as_integer(as_text(z, length)[::-1])
+
+class KeySchedule:
+    '''
+    Half-keys for `double_product` and `double_quotient` under a given key,
+    message length and schedule, kept as integers so that they can be
+    reused across many messages.
+    '''
+    __slots__ = 'length', 'modulus', 'half_key_1', 'half_key_2', 'inverse_half_key_1', 'inverse_half_key_2'
+    
+    def __init__(self, key, length=None, schedule='interleaved'):
+        if length is None:
+            length = len(key)
+        if schedule == 'nilpotent_shift':
+            inverse_key = inverse(key, length)
+            half_key_1 = sum(inverse_key, 'c')
+            half_key_2 = sum(inverse_key, 'f')
+        elif schedule == 'sequential':
+            inverse_key = inverse(key, 2*length)
+            half_key_1 = inverse_key[:length]
+            half_key_2 = inverse_key[length:]
+            if as_integer(half_key_2[0]) % 3 == 0:
+                half_key_2 = sum(half_key_2, half_key_1)
+        elif schedule == 'interleaved':
+            inverse_key = inverse(key, 2*length)
+            half_key_1 = inverse_key[0::2]
+            half_key_2 = inverse_key[1::2]
+            if as_integer(half_key_2[0]) % 3 == 0:
+                half_key_2 = sum(half_key_2, half_key_1)
+        else:
+            raise ValueError(f"Unknown schedule {schedule!r}")
+        self.length = length
+        self.modulus = gmpy2.mpz(27)**length
+        self.half_key_1 = as_integer(half_key_1)
+        self.half_key_2 = as_integer(half_key_2)
+        self.inverse_half_key_1 = inverse_integer(self.half_key_1, length)
+        self.inverse_half_key_2 = inverse_integer(self.half_key_2, length)
+    
+    def apply(self, text, key_1, key_2):
+        if len(text) > self.length:
+            raise ValueError("Message is longer than the key schedule")
+        z = as_integer(text) * key_1 % self.modulus
+        z = reverse_integer(z, self.length) * key_2 % self.modulus
+        return as_text(z, self.length)
+    
+    def encrypt(self, text):
+        return self.apply(text, self.inverse_half_key_1, self.inverse_half_key_2)
+    
+    def decrypt(self, text):
+        return self.apply(text, self.half_key_2, self.half_key_1)
+    
+    def encrypt_many(self, texts):
+        return [self.encrypt(text) for text in texts]
+    
+    def decrypt_many(self, texts):
+        return [self.decrypt(text) for text in texts]
+
+@functools.lru_cache(maxsize=1024)
+def key_schedule(key, length=None, schedule='interleaved'):
+    return KeySchedule(key, length, schedule)
+
 def double_product(text, key, schedule='interleaved'):
     size = max(len(text), len(key))
-    if schedule == 'nilpotent_shift':
-        inverse_key = inverse(key, size)
-        half_key_1 = inverse(sum(inverse_key, 'c'))
-        half_key_2 = inverse(sum(inverse_key, 'f'))
-    elif schedule == 'sequential':
-        inverse_key = inverse(key, 2*size)
-        half_key_1 = inverse_key[:size]
-        half_key_2 = inverse_key[size:]
-        if as_integer(half_key_2[0]) % 3 == 0:
-            half_key_2 = sum(half_key_2, half_key_1)
-        half_key_1 = inverse(half_key_1)
-        half_key_2 = inverse(half_key_2)
-    elif schedule == 'interleaved':
-        inverse_key = inverse(key, 2*size)
-        half_key_1 = inverse_key[0::2]
-        half_key_2 = inverse_key[1::2]
-        if as_integer(half_key_2[0]) % 3 == 0:
-            half_key_2 = sum(half_key_2, half_key_1)
-        half_key_1 = inverse(half_key_1)
-        half_key_2 = inverse(half_key_2)
-    intermediate = product(text, half_key_1)
-    return product(intermediate[::-1], half_key_2)
+    return key_schedule(key, size, schedule).encrypt(text)
 
 def double_quotient(text, key, schedule='interleaved'):
     size = max(len(text), len(key))
-    if schedule == 'nilpotent_shift':
-        inverse_key = inverse(key, size)
-        half_key_1 = sum(inverse_key, 'c')
-        half_key_2 = sum(inverse_key, 'f')
-    elif schedule == 'sequential':
-        inverse_key = inverse(key, 2*size)
-        half_key_1 = inverse_key[:size]
-        half_key_2 = inverse_key[size:]
-        if as_integer(half_key_2[0]) % 3 == 0:
-            half_key_2 = sum(half_key_2, half_key_1)
-    elif schedule == 'interleaved':
-        inverse_key = inverse(key, 2*size)
-        half_key_1 = inverse_key[0::2]
-        half_key_2 = inverse_key[1::2]
-        if as_integer(half_key_2[0]) % 3 == 0:
-            half_key_2 = sum(half_key_2, half_key_1)
-    intermediate = product(text, half_key_2)
-    return product(intermediate[::-1], half_key_1)
+    return key_schedule(key, size, schedule).decrypt(text)
+
+# Flags that need a key, in the order `apply_flags` applies them, with the
+# verb used to complain when the key is missing.
+keyed_flags = [
+    ('add', 'add'),
+    ('heisenberg_add', 'add'),
+    ('product', 'multiply'),
+    ('double_product', 'multiply'),
+    ('double_quotient', 'divide'),
+    ('quotient', 'divide'),
+    ('heisenberg_subtract', 'subtract'),
+    ('subtract', 'subtract'),
+]
+
+def apply_flags(text, args):
+    '''
+    Run `text` through the operations selected on the command line. Keyed
+    operations are skipped if there is no key.
+    '''
+    key = args.key
+    if args.compress:
+        text = compress(text)
+    if args.add and key is not None:
+        text = sum(text, key)
+    if args.heisenberg_add and key is not None:
+        text = heisenberg_add(text, key)
+    if args.product and key is not None:
+        text = product(text, key)
+    if args.double_product and key is not None:
+        text = double_product(text, key)
+    if args.mix:
+        text = trifid_mix(text)
+    if args.frobnicate:
+        text = frobnicate(text)
+    if args.unmix:
+        text = trifid_unmix(text)
+    if args.double_quotient and key is not None:
+        text = double_quotient(text, key)
+    if args.quotient and key is not None:
+        text = quotient(text, key)
+    if args.heisenberg_subtract and key is not None:
+        text = heisenberg_subtract(text, key)
+    if args.subtract and key is not None:
+        text = difference(text, key)
+    if args.decompress:
+        text = decompress(text)
+    return text
+
+def read_records(filenames, block_size=None):
+    '''
+    Yield records from the named files ('-' for stdin): lines without their
+    line endings or, if `block_size` is given, blocks of that many characters.
+    '''
+    import sys
+    for filename in filenames:
+        f = sys.stdin if filename == '-' else open(filename)
+        try:
+            if block_size is None:
+                for line in f:
+                    yield line.rstrip('\r\n')
+            else:
+                yield from read_chunks(f, block_size)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def process_records(records, args, jobs=1, chunksize=64):
+    '''
+    Apply the selected operations to each record, yielding results in order.
+    With more than one job, records are spread across a process pool in
+    batches of a few chunks per worker, so that only a bounded number of
+    records is held in memory at a time.
+    '''
+    process = functools.partial(apply_flags, args=args)
+    if jobs == 1:
+        yield from map(process, records)
+    else:
+        import multiprocessing
+        records = iter(records)
+        with multiprocessing.Pool(jobs) as pool:
+            while True:
+                batch = list(itertools.islice(records, 4*jobs*chunksize))
+                if len(batch) == 0:
+                    break
+                yield from pool.imap(process, batch, chunksize)
 
 
 if __name__ == '__main__':
     import argparse
+    import sys
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('text', type=str)
+    parser.add_argument('text', type=str, nargs='?', default=None,
+                        help="text to process; if omitted, read records from --input")
     parser.add_argument('-c', '--compress', action='store_true')
     parser.add_argument('-d', '--decompress', action='store_true')
     parser.add_argument('-m', '--mix', action='store_true')
@@ -296,57 +683,23 @@ if __name__ == '__main__':
     parser.add_argument('-q', '--quotient', action='store_true')
     parser.add_argument('-P', '--double-product', action='store_true')
     parser.add_argument('-Q', '--double-quotient', action='store_true')
+    parser.add_argument('-i', '--input', action='append', default=None,
+                        help="file to read records from, '-' for stdin (repeatable)")
+    parser.add_argument('-b', '--block-size', type=int, default=None,
+                        help="split input into blocks of this many characters instead of lines")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument('--chunksize', type=int, default=64,
+                        help="records sent to a worker at a time")
     args = parser.parse_args()
 
-    text = args.text
-    if args.compress:
-        text = compress(text)
-    if args.add:
-        if args.key is None:
-            print("Can't add without a key!") 
-        else:
-            text = sum(text, args.key)
-    if args.heisenberg_add:
-        if args.key is None:
-            print("Can't add without a key!") 
-        else:
-            text = heisenberg_add(text, args.key)
-    if args.product:
-        if args.key is None:
-            print("Can't multiply without a key!") 
-        else:
-            text = product(text, args.key)
-    if args.double_product:
-        if args.key is None:
-            print("Can't multiply without a key!") 
-        else:
-            text = double_product(text, args.key)
-    if args.mix:
-        text = trifid_mix(text)
-    if args.frobnicate:
-        text = frobnicate(text)
-    if args.unmix:
-        text = trifid_unmix(text)
-    if args.double_quotient:
-        if args.key is None:
-            print("Can't divide without a key!") 
-        else:
-            text = double_quotient(text, args.key)
-    if args.quotient:
-        if args.key is None:
-            print("Can't divide without a key!") 
-        else:
-            text = quotient(text, args.key)
-    if args.heisenberg_subtract:
-        if args.key is None:
-            print("Can't subtract without a key!") 
-        else:
-            text = heisenberg_subtract(text, args.key)
-    if args.subtract:
-        if args.key is None:
-            print("Can't subtract without a key!") 
-        else:
-            text = difference(text, args.key)
-    if args.decompress:
-        text = decompress(text)
-    print(text)
+    for flag, verb in keyed_flags:
+        if getattr(args, flag) and args.key is None:
+            print(f"Can't {verb} without a key!", file=sys.stderr)
+
+    if args.text is not None:
+        print(apply_flags(args.text, args))
+    else:
+        records = read_records(args.input or ['-'], args.block_size)
+        for text in process_records(records, args, args.jobs, args.chunksize):
+            sys.stdout.write(text + '\n')
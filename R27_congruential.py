@@ -1,29 +1,103 @@
+import functools
+
 from R27 import *
 
 class LCG:
-    __slots__ = 'multiplier', 'offset', 'modulus'
+    __slots__ = 'multiplier', 'offset', 'modulus', 'table'
     
-    def __init__(self, multiplier, offset, modulus):
-        self.multiplier = multiplier
-        self.offset = offset
-        self.modulus = modulus
+    def __init__(self, multiplier, offset, modulus, table_limit=2**12):
+        self.multiplier = gmpy2.mpz(multiplier)
+        self.offset = gmpy2.mpz(offset)
+        self.modulus = gmpy2.mpz(modulus)
+        # table[i] is the (multiplier, offset) pair of the affine map
+        # that advances the generator by 2**i steps. It grows with the
+        # square of the modulus size, so it is only kept for moduli of up
+        # to `table_limit` bits.
+        if self.modulus.bit_length() <= table_limit:
+            self.table = [(self.multiplier % self.modulus, self.offset % self.modulus)]
+        else:
+            self.table = None
     
     def step(self, start):
         return (self.multiplier*start + self.offset) % self.modulus
     
+    def square(self, pair):
+        '''
+        Compose the affine map given by `pair` with itself.
+        '''
+        multiplier, offset = pair
+        return multiplier*multiplier % self.modulus, (multiplier + 1)*offset % self.modulus
+    
+    def extend_table(self, size):
+        while len(self.table) < size:
+            self.table.append(self.square(self.table[-1]))
+    
+    def jump(self, steps):
+        '''
+        Return the (multiplier, offset) pair of the affine map that advances
+        the generator by `steps` steps, composed from the jump-ahead table.
+        Without a table, the map is built by square-and-multiply from the
+        top bit down, so only single steps are ever composed onto it.
+        '''
+        steps = gmpy2.mpz(steps)
+        multiplier = gmpy2.mpz(1)
+        offset = gmpy2.mpz(0)
+        if self.table is None:
+            for i in range(steps.bit_length() - 1, -1, -1):
+                multiplier, offset = self.square((multiplier, offset))
+                if steps.bit_test(i):
+                    offset = (self.multiplier*offset + self.offset) % self.modulus
+                    multiplier = (self.multiplier*multiplier) % self.modulus
+            return multiplier, offset
+        
+        self.extend_table(steps.bit_length())
+        for i in range(steps.bit_length()):
+            if steps.bit_test(i):
+                jump_multiplier, jump_offset = self.table[i]
+                offset = (jump_multiplier*offset + jump_offset) % self.modulus
+                multiplier = (jump_multiplier*multiplier) % self.modulus
+        return multiplier, offset
+    
     def advance(self, start, steps):
-        index = steps.bit_length() - 1
-        multiplier = 1
-        offset = 0
-        while index >= 0:
-            offset = ((multiplier + 1)*offset) % self.modulus
-            multiplier = (multiplier*multiplier) % self.modulus
-            if steps & 2**index != 0:
-                offset = (self.multiplier*offset + self.offset) % self.modulus
-                multiplier = (self.multiplier*multiplier) % self.modulus
-            index -= 1
-        result = (multiplier*start + offset) % self.modulus
-        return result
+        multiplier, offset = self.jump(steps)
+        return (multiplier*start + offset) % self.modulus
+    
+    def advance_many(self, starts, steps):
+        '''
+        Advance each of `starts` by the corresponding number of `steps`, or
+        all of them by the same number if `steps` is a single integer.
+        '''
+        if isinstance(steps, (int, type(gmpy2.mpz(0)))):
+            multiplier, offset = self.jump(steps)
+            return [(multiplier*start + offset) % self.modulus for start in starts]
+        return [self.advance(start, step) for start, step in zip(starts, steps)]
+
+@functools.lru_cache(maxsize=64)
+def cached_ternary_lcg(multiplier, offset, length):
+    return LCG(multiplier, offset, 27**length)
+
+def ternary_lcg(multiplier, offset, length, cache_limit=256):
+    '''
+    The generator for messages of the given length. Generators for lengths
+    up to `cache_limit` (e.g. blocks) are kept, so that their jump-ahead
+    tables are shared between messages; longer ones are built afresh.
+    '''
+    if length <= cache_limit:
+        return cached_ternary_lcg(multiplier, offset, length)
+    return LCG(multiplier, offset, 27**length)
+
+def crypt_block(task):
+    '''
+    Encrypt or decrypt a single block. Takes a single tuple so that it can
+    be mapped over a process pool.
+    '''
+    multiplier, offset, block, steps, decrypt = task
+    length = len(block)
+    lcg = ternary_lcg(multiplier, offset, length)
+    if decrypt:
+        steps = -steps
+    result = lcg.advance(as_integer(block), steps % lcg.modulus)
+    return as_text(result, length)
 
 class TernaryScheme:
     __slots__ = 'multiplier', 'offset'
@@ -36,21 +110,24 @@ class TernaryScheme:
         if self.offset % 3 == 0:
             raise ValueError("Offset must not be divisible by 3")
     
+    def lcg(self, length):
+        return ternary_lcg(self.multiplier, self.offset, length)
+    
     def encrypt(self, plaintext, key):
         length = len(plaintext)
-        lcg = LCG(self.multiplier, self.offset, 27**length)
+        lcg = self.lcg(length)
         result = lcg.advance(as_integer(plaintext), as_integer(key))
         return as_text(result, length)
     
     def decrypt(self, ciphertext, key):
         length = len(ciphertext)
-        lcg = LCG(self.multiplier, self.offset, 27**length)
-        result = lcg.advance(as_integer(ciphertext), lcg.modulus - as_integer(key))
+        lcg = self.lcg(length)
+        result = lcg.advance(as_integer(ciphertext), -as_integer(key) % lcg.modulus)
         return as_text(result, length)
     
     def encrypt_double(self, plaintext, key1, key2):
         length = len(plaintext)
-        lcg = LCG(self.multiplier, self.offset, 27**length)
+        lcg = self.lcg(length)
         result1 = lcg.advance(as_integer(plaintext), as_integer(key1))
         intermediate = as_text(result1, length)[::-1]
         result2 = lcg.advance(as_integer(intermediate), as_integer(key2))
@@ -58,8 +135,48 @@ class TernaryScheme:
     
     def decrypt_double(self, ciphertext, key1, key2):
         length = len(ciphertext)
-        lcg = LCG(self.multiplier, self.offset, 27**length)
-        result1 = lcg.advance(as_integer(ciphertext), lcg.modulus - as_integer(key2))
+        lcg = self.lcg(length)
+        result1 = lcg.advance(as_integer(ciphertext), -as_integer(key2) % lcg.modulus)
         intermediate = as_text(result1, length)[::-1]
-        result0 = lcg.advance(as_integer(intermediate), lcg.modulus - as_integer(key1))
+        result0 = lcg.advance(as_integer(intermediate), -as_integer(key1) % lcg.modulus)
         return as_text(result0, length)
+    
+    def block_steps(self, key, block_size, first_block, count):
+        '''
+        Yield the step counts for `count` consecutive blocks starting at
+        `first_block`. These are successive states of the block-sized
+        generator, starting from the key, so any block's state can be
+        reached directly by jumping ahead.
+        '''
+        lcg = self.lcg(block_size)
+        steps = lcg.advance(as_integer(key) % lcg.modulus, first_block)
+        for i in range(count):
+            yield steps
+            steps = lcg.step(steps)
+    
+    def crypt_blocks(self, text, key, block_size, first_block, jobs, decrypt):
+        blocks = [text[i:i+block_size] for i in range(0, len(text), block_size)]
+        steps = self.block_steps(key, block_size, first_block, len(blocks))
+        tasks = [(self.multiplier, self.offset, block, step, decrypt)
+                 for block, step in zip(blocks, steps)]
+        if jobs == 1:
+            return ''.join(map(crypt_block, tasks))
+        import multiprocessing
+        with multiprocessing.Pool(jobs) as pool:
+            return ''.join(pool.map(crypt_block, tasks, chunksize=max(len(tasks) // (4*jobs), 1)))
+    
+    def encrypt_blocks(self, plaintext, key, block_size=64, first_block=0, jobs=1):
+        '''
+        Encrypt in block mode: each `block_size`-character block (the last
+        may be shorter) is encrypted independently, so blocks can be spread
+        over `jobs` processes. `first_block` gives the index of the first
+        block in `plaintext` within the whole message.
+        '''
+        return self.crypt_blocks(plaintext, key, block_size, first_block, jobs, False)
+    
+    def decrypt_blocks(self, ciphertext, key, block_size=64, first_block=0, jobs=1):
+        '''
+        Decrypt in block mode. To decrypt blocks i to j of a message alone,
+        pass ciphertext[i*block_size:j*block_size] with `first_block=i`.
+        '''
+        return self.crypt_blocks(ciphertext, key, block_size, first_block, jobs, True)
@@ -1,20 +1,155 @@
-import sympy
+import functools
+import gmpy2
+import numpy as np
 
 from R27 import *
 
-x = sympy.var('x')
+def bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+def int_to_bits(n, length):
+    n &= (1 << length) - 1
+    data = np.frombuffer(n.to_bytes((length + 7)//8, 'little'), dtype=np.uint8)
+    return np.unpackbits(data, count=length, bitorder='little')
+
+class Poly3:
+    '''
+    A polynomial over GF(3), stored in (ternary) Frieder-Luk form: a pair of
+    integers whose set bits mark the coefficients equal to one and to two,
+    respectively. Addition and negation are bitwise; multiplication goes
+    through a single big-integer product (Kronecker substitution).
+    '''
+    __slots__ = 'ones', 'twos'
+    
+    def __init__(self, ones=0, twos=0):
+        self.ones = ones
+        self.twos = twos
+    
+    @classmethod
+    def from_coeffs(cls, coeffs):
+        '''
+        Build a polynomial from its coefficients, constant term first.
+        '''
+        coeffs = np.asarray(coeffs) % 3
+        return cls(bits_to_int(coeffs == 1), bits_to_int(coeffs == 2))
+    
+    def coeffs(self, length=None):
+        '''
+        Coefficients as a uint8 array, constant term first, padded with zeros
+        (or truncated) to `length` if given.
+        '''
+        if length is None:
+            length = self.degree() + 1
+        return int_to_bits(self.ones, length) + 2*int_to_bits(self.twos, length)
+    
+    def degree(self):
+        return max(self.ones.bit_length(), self.twos.bit_length()) - 1
+    
+    def leading_coeff(self):
+        return 1 if self.ones.bit_length() > self.twos.bit_length() else 2
+    
+    def truncate(self, length):
+        '''
+        Reduce modulo x**length.
+        '''
+        mask = (1 << length) - 1
+        return Poly3(self.ones & mask, self.twos & mask)
+    
+    def __eq__(self, other):
+        if not isinstance(other, Poly3):
+            return NotImplemented
+        return self.ones == other.ones and self.twos == other.twos
+    
+    def __neg__(self):
+        return Poly3(self.twos, self.ones)
+    
+    def __add__(self, other):
+        zeros_a = ~self.ones & ~self.twos
+        zeros_b = ~other.ones & ~other.twos
+        ones = zeros_a & other.ones | self.ones & zeros_b | self.twos & other.twos
+        twos = zeros_a & other.twos | self.twos & zeros_b | self.ones & other.ones
+        return Poly3(ones, twos)
+    
+    def __sub__(self, other):
+        return self + -other
+    
+    def __lshift__(self, shift):
+        return Poly3(self.ones << shift, self.twos << shift)
+    
+    def __mul__(self, other):
+        if isinstance(other, int):
+            return [Poly3(), self, -self][other % 3]
+        a, b = self.coeffs(), other.coeffs()
+        if len(a) == 0 or len(b) == 0:
+            return Poly3()
+        # Each coefficient of the integer product is at most 4*min(len(a), len(b)),
+        # so it fits in a fixed-width field without carrying into the next.
+        bound = 4*min(len(a), len(b))
+        dtype = next(dtype for dtype in ['<u1', '<u2', '<u4', '<u8']
+                     if bound < np.iinfo(dtype).max)
+        pack = lambda c: gmpy2.mpz(int.from_bytes(c.astype(dtype).tobytes(), 'little'))
+        width = np.dtype(dtype).itemsize
+        length = len(a) + len(b) - 1
+        z = int(pack(a) * pack(b))
+        coeffs = np.frombuffer(z.to_bytes(length*width, 'little'), dtype=dtype) % 3
+        return Poly3.from_coeffs(coeffs)
+    
+    __rmul__ = __mul__
+    
+    def mul_trunc(self, other, length):
+        '''
+        Multiply modulo x**length.
+        '''
+        return (self.truncate(length) * other.truncate(length)).truncate(length)
+    
+    def inverse_trunc(self, length):
+        '''
+        Inverse modulo x**length, by Newton iteration: if g inverts the
+        polynomial modulo x**k, then g*(2 - self*g) inverts it modulo x**(2k).
+        '''
+        assert(self.ones & 1 or self.twos & 1)
+        precisions = []
+        while length > 1:
+            precisions.append(length)
+            length = (length + 1)//2
+        # The constant term is its own inverse mod 3.
+        inverse = Poly3(self.ones & 1, self.twos & 1)
+        for precision in reversed(precisions):
+            error = self.mul_trunc(inverse, precision)
+            inverse = inverse.mul_trunc(Poly3(0, 1) - error, precision)
+        return inverse
+    
+    def __divmod__(self, other):
+        '''
+        Long division. Since the leading coefficient of `other` is its own
+        inverse mod 3, each step subtracts a shifted multiple of `other`.
+        '''
+        degree = other.degree()
+        if degree < 0:
+            raise ZeroDivisionError('polynomial division by zero')
+        quotient = Poly3()
+        remainder = self
+        lc = other.leading_coeff()
+        while remainder.degree() >= degree:
+            shift = remainder.degree() - degree
+            term = (Poly3(1) << shift) * (remainder.leading_coeff() * lc)
+            quotient = quotient + term
+            remainder = remainder - (other << shift) * (remainder.leading_coeff() * lc)
+        return quotient, remainder
+    
+    def __repr__(self):
+        return f'Poly3.from_coeffs({self.coeffs().tolist()})'
 
 def as_poly(text):
-    return sympy.Poly(demux(text)[::-1], x, modulus=3)
+    return Poly3.from_coeffs(demux_array(text))
 
 def mux_poly(poly, length = None):
-    coeffs = [c % 3 for c in poly.as_list()[::-1]]
+    coeffs = poly.coeffs()
     extend_by = {0: 0, 1: 2, 2: 1}[len(coeffs) % 3]
     if length is not None:
         orig_length = (len(coeffs) + extend_by)//3
         extend_by += (3*(length - orig_length) if length > orig_length else 0)
-    coeffs.extend([0]*extend_by)
-    return mux(coeffs)
+    return mux_array(np.concatenate([coeffs, np.zeros(extend_by, dtype=np.uint8)]))
 
 def poly_euclid(a, b):
     if b.degree() > a.degree():
@@ -22,12 +157,12 @@ def poly_euclid(a, b):
     else:
         bigger, smaller = a, b
     
-    prev_coeff_bigger = sympy.Poly(1, x, modulus=3)
-    prev_coeff_smaller = sympy.Poly(0, x, modulus=3)
-    coeff_bigger = sympy.Poly(0, x, modulus=3)
-    coeff_smaller = sympy.Poly(1, x, modulus=3)
+    prev_coeff_bigger = Poly3(1)
+    prev_coeff_smaller = Poly3(0)
+    coeff_bigger = Poly3(0)
+    coeff_smaller = Poly3(1)
     while smaller.degree() >= 0:
-        quotient, remainder = bigger.div(smaller)
+        quotient, remainder = divmod(bigger, smaller)
         bigger = smaller
         smaller = remainder
         next_coeff_bigger = prev_coeff_bigger - quotient*coeff_bigger
@@ -36,29 +171,25 @@ def poly_euclid(a, b):
         prev_coeff_smaller = coeff_smaller
         coeff_bigger = next_coeff_bigger
         coeff_smaller = next_coeff_smaller
-    leading_coeff = sympy.Poly(bigger.coeffs()[0], x, modulus=3)
+    leading_coeff = bigger.leading_coeff()
     gcd = leading_coeff*bigger
     cofactor_bigger = leading_coeff*prev_coeff_bigger
     cofactor_smaller = leading_coeff*prev_coeff_smaller
     return gcd, cofactor_bigger, cofactor_smaller
 
+@functools.lru_cache(maxsize=1024)
 def poly_inverse(key, length=None):
     if length is None:
         length = len(key)
-    modulus = sympy.Poly(x**(3*length), x, modulus=3)
     p_key = as_poly(key)
-    
-    assert(p_key.coeffs()[-1] != 0)
-    gcd, coeff, inverse = poly_euclid(p_key, modulus)
-    assert(gcd == sympy.Poly(1, x, modulus=3))
-    inverse = inverse % modulus
-    return mux_poly(inverse)
+    inverse = p_key.inverse_trunc(3*length)
+    return mux_poly(inverse, length)
 
 def poly_sum(text1, text2):
     length = max(len(text1), len(text2))
-    p1, p2 = as_poly(text1), as_integer(text2)
+    p1, p2 = as_poly(text1), as_poly(text2)
     
-    p_out = p1 + p2 % sympy.Poly(x**(3*length), x, modulus=3)
+    p_out = (p1 + p2).truncate(3*length)
     
     return mux_poly(p_out, length)
 
@@ -66,7 +197,7 @@ def poly_product(text, key):
     length = max(len(text), len(key))
     p_text, p_key = as_poly(text), as_poly(key)
     
-    p_out = p_text * p_key % sympy.Poly(x**(3*length), x, modulus=3)
+    p_out = p_text.mul_trunc(p_key, 3*length)
     
     return mux_poly(p_out, length)
 
@@ -0,0 +1,183 @@
+import argparse
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+import yaml
+
+import R27
+
+alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ+'
+
+def random_text(length, seed=0):
+    rng = random.Random(seed)
+    return ''.join(rng.choices(alphabet, k=length))
+
+def random_key(length, seed=1):
+    '''
+    A random key whose first symbol is not divisible by 3, so that it is
+    invertible.
+    '''
+    return 'A' + random_text(length - 1, seed)
+
+operations = {
+    'demux': lambda text, key: R27.demux_array(text),
+    'mux': lambda text, key: R27.mux_array(R27.demux_array(text)),
+    'compress': lambda text, key: R27.compress(text),
+    'decompress': lambda text, key: R27.decompress(text),
+    'trifid_mix': lambda text, key: R27.trifid_mix(text),
+    'trifid_unmix': lambda text, key: R27.trifid_unmix(text),
+    'heisenberg_add': lambda text, key: R27.heisenberg_add(text, key),
+    'heisenberg_subtract': lambda text, key: R27.heisenberg_subtract(text, key),
+    'sum': lambda text, key: R27.sum(text, key),
+    'product': lambda text, key: R27.product(text, key),
+    'inverse': lambda text, key: R27.inverse(key),
+    'quotient': lambda text, key: R27.quotient(text, key),
+    'double_product': lambda text, key: R27.double_product(text, key),
+    'double_quotient': lambda text, key: R27.double_quotient(text, key),
+    'frobnicate': lambda text, key: R27.frobnicate(text),
+}
+
+flag_names = [
+    'compress', 'decompress', 'mix', 'unmix', 'frobnicate', 'add', 'subtract',
+    'heisenberg_add', 'heisenberg_subtract', 'product', 'quotient',
+    'double_product', 'double_quotient',
+]
+
+# Command-line flag combinations: every flag on its own, plus the pipelines
+# we actually run.
+flag_combinations = [(flag,) for flag in flag_names] + [
+    ('compress', 'product', 'mix'),
+    ('unmix', 'quotient', 'decompress'),
+    ('compress', 'double_product', 'mix'),
+    ('unmix', 'double_quotient', 'decompress'),
+    ('compress', 'heisenberg_add', 'product', 'mix'),
+]
+
+def flag_operation(flags):
+    def run(text, key):
+        args = argparse.Namespace(key=key, **{flag: flag in flags for flag in flag_names})
+        return R27.apply_flags(text, args)
+    return run
+
+for flags in flag_combinations:
+    operations['cli:' + '+'.join(flags)] = flag_operation(flags)
+
+def clear_caches():
+    R27.inverse.cache_clear()
+    R27.key_schedule.cache_clear()
+
+def max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return rss if sys.platform == 'darwin' else 1024*rss
+
+def rss_case(name, length):
+    '''
+    Run one case in a fresh process and return how far it raised the peak
+    resident set size. Unlike tracemalloc, this sees GMP's allocations.
+    '''
+    text = random_text(length)
+    key = random_key(length)
+    before = max_rss()
+    operations[name](text, key)
+    return max_rss() - before
+
+def measure(operation, text, key, repeat):
+    '''
+    Return the best wall-clock time over `repeat` runs and the peak memory
+    traced by tracemalloc during one further run. Memory held by GMP is not
+    traced; see `rss_case`.
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        operation(text, key)
+        best = min(best, time.perf_counter() - start)
+
+    clear_caches()
+    tracemalloc.start()
+    operation(text, key)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def run_benchmarks(names, lengths, repeat=3, max_seconds=10.0):
+    '''
+    Benchmark each named operation at each message length. Once an operation
+    takes longer than `max_seconds`, it is skipped at larger lengths.
+    '''
+    # Each RSS case gets a fresh worker forked from a server started before
+    # any benchmarks run, so it does not inherit this process's peak.
+    pool = multiprocessing.get_context('forkserver').Pool(1, maxtasksperchild=1)
+    results = {}
+    for name in names:
+        operation = operations[name]
+        results[name] = {}
+        for length in lengths:
+            text = random_text(length)
+            key = random_key(length)
+            seconds, peak = measure(operation, text, key, repeat)
+            rss = pool.apply(rss_case, (name, length))
+            results[name][length] = {
+                'seconds': seconds,
+                'chars_per_second': length / seconds if seconds > 0 else None,
+                'peak_bytes': peak,
+                'peak_rss_bytes': rss,
+            }
+            print(f"{name:>40} {length:>8} {seconds:12.6f} s {peak:>12} B {rss:>12} B RSS", flush=True)
+            if seconds > max_seconds:
+                break
+    pool.terminate()
+    return results
+
+def compare(old, new):
+    '''
+    Print the ratio of new to old times for every result present in both.
+    '''
+    for name, by_length in new.items():
+        for length, result in by_length.items():
+            if name in old and length in old[name]:
+                ratio = result['seconds'] / old[name][length]['seconds']
+                print(f"{name:>40} {length:>8} {ratio:8.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('operations', nargs='*', default=None,
+                        help="operations to run (default: all)")
+    parser.add_argument('-n', '--max-length', type=int, default=10**6)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-t', '--max-seconds', type=float, default=10.0)
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="YAML file to write results to")
+    parser.add_argument('-c', '--compare', type=str, default=None,
+                        help="YAML file from an earlier run to compare against")
+    parser.add_argument('-l', '--list', action='store_true')
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(operations))
+    else:
+        lengths = []
+        length = 10
+        while length <= args.max_length:
+            lengths.append(length)
+            length *= 10
+        names = args.operations or list(operations)
+        results = run_benchmarks(names, lengths, args.repeat, args.max_seconds)
+
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                yaml.safe_dump({
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'results': results,
+                }, f)
+        if args.compare is not None:
+            with open(args.compare) as f:
+                compare(yaml.safe_load(f)['results'], results)
@@ -1,5 +1,7 @@
-from itertools import product
-from score import score_markov
+import functools
+import heapq
+import numpy as np
+from score import identity_mapping, ind, indices, markov_scores, score_counts, score_markov, transition_counts
 from subs import alphabet26 as alphabet
 import subs
 import vigenere
@@ -14,18 +16,40 @@ def check(cryptogram):
         print(ct_alpha + ':')
         print(guess)
 
+def key_mapping(ct_alpha):
+    '''
+    Slot mapping (see `score.transition_counts`) which takes each ciphertext
+    letter to its plaintext letter under the cipher alphabet `ct_alpha`.
+    '''
+    mapping = identity_mapping.copy()
+    for i, c in enumerate(ct_alpha):
+        mapping[ind(c) + 27] = ind(alphabet[i])
+    return mapping
+
+def score_keys(ct_alphas, cryptogram):
+    '''
+    Markov scores of the decryptions of `cryptogram` under each cipher
+    alphabet in `ct_alphas`, without decrypting. The cryptogram is reduced to
+    transition counts once, so the cost per key does not depend on its length.
+    '''
+    counts, last = transition_counts(cryptogram)
+    mappings = np.array([key_mapping(ct_alpha) for ct_alpha in ct_alphas])
+    return score_counts(counts, last, mappings.reshape(len(ct_alphas), -1))
+
 def solve(cryptogram, return_key=False):
-    min_score = score_markov(cryptogram)
-    soln = cryptogram
-    soln_ct_alpha = alphabet
-    for i in range(26):
-        ct_alpha = alphabet[i:] + alphabet[:i]
-        guess = subs.decrypt(ct_alpha, cryptogram)
-        score = score_markov(guess)
-        if score < min_score:
-            min_score = score
-            soln = guess
-            soln_ct_alpha = ct_alpha
+    ct_alphas = [alphabet[i:] + alphabet[:i] for i in range(26)]
+    counts, last = transition_counts(cryptogram)
+    # The unchanged cryptogram is scored in the same batch as the shifts, so
+    # that the unshifted alphabet never looks like an improvement on it.
+    mappings = np.array([identity_mapping] + [key_mapping(ct_alpha) for ct_alpha in ct_alphas])
+    unchanged, *scores = score_counts(counts, last, mappings)
+    best = np.argmin(scores)
+    if scores[best] < unchanged:
+        soln_ct_alpha = ct_alphas[best]
+        soln = subs.decrypt(soln_ct_alpha, cryptogram)
+    else:
+        soln_ct_alpha = alphabet
+        soln = cryptogram
     if return_key:
         return soln_ct_alpha, soln
     else:
@@ -34,23 +58,172 @@ def solve(cryptogram, return_key=False):
 def atbash(message):
     return subs.encrypt(alphabet[::-1], message)
 
-def solve_vig(cryptogram, key_length):
+def vig_terms(cryptogram, key_length):
+    '''
+    Split the Markov score of a Vigenère decryption of `cryptogram` into
+    parts that depend on one or two key letters. Returns `unary`, where
+    unary[j, s] is the part that depends only on key letter j being shift s,
+    `pair`, where pair[j, s, t] is the part that depends on key letter j
+    being s and the next one (cyclically) being t, and a constant.
+    '''
+    inds = indices(cryptogram)
+    prev = np.zeros_like(inds)
+    prev[1:] = inds[:-1]
+    is_letter = (inds >= 1) & (inds <= 26)
+    cols = (np.cumsum(is_letter) - 1) % key_length
+    prev_is_letter = np.zeros_like(is_letter)
+    prev_is_letter[1:] = is_letter[:-1]
+    prev_cols = np.zeros_like(cols)
+    prev_cols[1:] = cols[:-1]
+    
+    # Plaintext index of ciphertext letter c under each shift: shift_inds[c, s]
+    shifts = np.arange(26)
+    shift_inds = (shifts[:, None] - shifts[None, :]) % 26 + 1
+    
+    unary = np.zeros((key_length, 26))
+    pair = np.zeros((key_length, 26, 26))
+    
+    # Transitions between two letters depend on two adjacent key letters.
+    both = is_letter & prev_is_letter
+    keys, counts = np.unique(np.stack([prev_cols[both], prev[both] - 1, inds[both] - 1]), axis=1, return_counts=True)
+    for j in range(key_length):
+        in_col = keys[0] == j
+        cur_inds = shift_inds[keys[2, in_col]][:, None, :]
+        prev_inds = shift_inds[keys[1, in_col]][:, :, None]
+        pair[j] = np.tensordot(counts[in_col], markov_scores[cur_inds, prev_inds], axes=1)
+    
+    # Transitions between a letter and anything else depend on one key
+    # letter. This includes the start of the text, which counts as a
+    # transition from index 0, and the end, a transition to index 0.
+    into = is_letter & ~prev_is_letter
+    keys, counts = np.unique(np.stack([cols[into], inds[into] - 1, prev[into]]), axis=1, return_counts=True)
+    np.add.at(unary, keys[0], counts[:, None] * markov_scores[shift_inds[keys[1]], keys[2][:, None]])
+    out_of = ~is_letter & prev_is_letter
+    keys, counts = np.unique(np.stack([prev_cols[out_of], prev[out_of] - 1, inds[out_of]]), axis=1, return_counts=True)
+    np.add.at(unary, keys[0], counts[:, None] * markov_scores[keys[2][:, None], shift_inds[keys[1]]])
+    
+    neither = ~is_letter & ~prev_is_letter
+    constant = markov_scores[inds[neither], prev[neither]].sum()
+    if len(inds) == 0:
+        constant += markov_scores[0, 0]
+    elif is_letter[-1]:
+        unary[cols[-1]] += markov_scores[shift_inds[inds[-1] - 1], 0]
+    else:
+        constant += markov_scores[inds[-1], 0]
+    
+    return unary, pair, constant
+
+def top_vig_keys(cryptogram, key_length, top=10):
+    '''
+    Find the `top` Vigenère keys of length `key_length` whose decryptions of
+    `cryptogram` have the lowest Markov scores, as a list of (score, key)
+    pairs, best first. Since the score splits into terms on single key letters
+    and adjacent pairs (see `vig_terms`), this is an exact search: for each
+    first key letter, a dynamic program around the key keeps the `top` best
+    partial keys ending in each letter.
+    '''
+    unary, pair, constant = vig_terms(cryptogram, key_length)
+    shifts = np.arange(26)
+    all_scores = []
+    all_keys = []
+    for first in range(26):
+        scores = np.full((26, 1), np.inf)
+        scores[first] = unary[0, first]
+        keys = np.full((26, 1, 1), first)
+        for j in range(1, key_length):
+            # candidates[prev, rank, next]
+            candidates = scores[:, :, None] + pair[j - 1][:, None, :] + unary[j]
+            width = candidates.shape[1]
+            candidates = candidates.reshape(-1, 26)
+            order = np.argsort(candidates, axis=0, kind='stable')[:top].T
+            scores = np.take_along_axis(candidates.T, order, axis=1)
+            prev_letters, prev_ranks = np.divmod(order, width)
+            keys = np.concatenate([
+                keys[prev_letters, prev_ranks],
+                np.broadcast_to(shifts[:, None, None], order.shape + (1,)),
+            ], axis=2)
+        scores = scores + pair[key_length - 1][:, first][:, None]
+        all_scores.append(scores.ravel())
+        all_keys.append(keys.reshape(-1, key_length))
+    all_scores = np.concatenate(all_scores) + constant
+    all_keys = np.concatenate(all_keys)
+    order = np.argsort(all_scores, kind='stable')[:top]
+    return [(all_scores[i], ''.join(alphabet[s] for s in all_keys[i]))
+            for i in order if np.isfinite(all_scores[i])]
+
+@functools.lru_cache(maxsize=None)
+def word_keys():
+    '''
+    The word list as Vigenère keys: deduplicated, uppercased, and grouped by
+    length into arrays of shifts, one key per row.
+    '''
+    by_length = {}
+    for key in sorted(set(word.upper() for word in words)):
+        if key.isascii() and key.isalpha():
+            by_length.setdefault(len(key), []).append(key)
+    return {
+        length: np.frombuffer(''.join(keys).encode('ascii'), dtype=np.uint8).reshape(-1, length) - ord('A')
+        for length, keys in by_length.items()
+    }
+
+def score_word_keys(task):
+    '''
+    Find the `top` best keys out of an array of keys of the same length, as
+    (score, key) pairs. Markov scores are non-negative, so the single-letter
+    terms alone bound each key's score from below; keys whose bound is
+    already worse than `top` fully scored keys are never fully scored.
+    '''
+    cryptogram, keys, top = task
+    key_length = keys.shape[1]
+    unary, pair, constant = vig_terms(cryptogram, key_length)
+    columns = np.arange(key_length)
+    bounds = constant + unary[columns, keys].sum(axis=1)
+    
+    def full_scores(rows):
+        rows_keys = keys[rows]
+        return bounds[rows] + pair[columns, rows_keys, np.roll(rows_keys, -1, axis=1)].sum(axis=1)
+    
+    first = np.argsort(bounds, kind='stable')[:top]
+    threshold = full_scores(first).max(initial=-np.inf)
+    rows = np.flatnonzero(bounds <= threshold)
+    scores = full_scores(rows)
+    return heapq.nsmallest(top, (
+        (scores[i], ''.join(alphabet[s] for s in keys[row]))
+        for i, row in enumerate(rows) if np.isfinite(scores[i])
+    ))
+
+def top_word_keys(cryptogram, top=10, jobs=1, shard_size=2**14):
+    '''
+    Find the `top` keys from the word list whose Vigenère decryptions of
+    `cryptogram` have the lowest Markov scores, as (score, key) pairs, best
+    first. Keys are scored in shards of one length at a time, spread across
+    a process pool when `jobs` is more than 1.
+    '''
+    tasks = [
+        (cryptogram, keys[start:start + shard_size], top)
+        for length, keys in sorted(word_keys().items())
+        for start in range(0, len(keys), shard_size)
+    ]
+    if jobs == 1:
+        shards = list(map(score_word_keys, tasks))
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(jobs) as pool:
+            shards = list(pool.imap_unordered(score_word_keys, tasks))
+    return heapq.nsmallest(top, (result for shard in shards for result in shard))
+
+def solve_vig(cryptogram, key_length, jobs=1):
     min_score = score_markov(cryptogram)
     soln = cryptogram
     soln_key = 'A'
     
     if key_length == 'words':
-        test_keys = (word.upper() for word in words)
+        results = top_word_keys(cryptogram, top=1, jobs=jobs)
     else:
-        test_keys = product(*([alphabet]*key_length))
-    
-    for test_key in test_keys:
-        test_key = ''.join(test_key)
-        guess = vigenere.decrypt(test_key, cryptogram)
-        score = score_markov(guess)
+        results = top_vig_keys(cryptogram, key_length, top=1)
+    for score, test_key in results:
         if score < min_score:
-            min_score = score
-            soln = guess
+            soln = vigenere.decrypt(test_key, cryptogram)
             soln_key = test_key
     
     return soln_key, soln
@@ -1,4 +1,6 @@
-from primitive_polynomials import all_factors
+from primitive_polynomials import all_factors, conjugate_search, polysearchp
+import gmpy2
+import numpy as np
 import sympy
 
 def to_fl(n):
@@ -6,38 +8,98 @@ def to_fl(n):
     Calculate the (ternary) Frieder-Luk encoding of a positive integer `n`.
     This consists of a pair of integers: one whose set bits correspond to
     the ones in the ternary expansion of `n`, and another whose set bits
-    correspond to the twos.
+    correspond to the twos. The ternary digits come from gmpy2 in one go and
+    are packed into bits with NumPy.
     '''
-    digits = []
-    while n != 0:
-        digits.append(n % 3)
-        n //= 3
-    
-    ones = 0
-    twos = 0
-    for digit in digits[::-1]:
-        ones = 2*ones + (digit == 1)
-        twos = 2*twos + (digit == 2)
-    
-    return ones, twos
+    if n == 0:
+        return 0, 0
+    digits = np.frombuffer(gmpy2.digits(n, 3).encode('ascii'), dtype=np.uint8)[::-1] - ord('0')
+    ones = np.packbits(digits == 1, bitorder='little').tobytes()
+    twos = np.packbits(digits == 2, bitorder='little').tobytes()
+    return int.from_bytes(ones, 'little'), int.from_bytes(twos, 'little')
 
 
 def from_fl(pair):
     '''
     Given a pair of numbers which constitute the ternary Frieder-Luk encoding
-    of a single integer, determine that integer.
+    of a single integer, determine that integer. The bits are unpacked with
+    NumPy into a ternary digit string, which gmpy2 converts in one go.
     '''
     ones, twos = pair
-    digits = []
-    while ones != 0 or twos != 0:
-        digits.append(2*(twos % 2) + ones % 2)
-        ones //= 2
-        twos //= 2
+    both = ones & twos
+    if both != 0:
+        # A trit with both bits set counts as 3, i.e. a one in the next trit.
+        return from_fl((ones ^ both, twos ^ both)) + from_fl((both << 1, 0))
+    length = max(ones.bit_length(), twos.bit_length())
+    if length == 0:
+        return 0
+    size = (length + 7) // 8
+    ones = np.unpackbits(np.frombuffer(ones.to_bytes(size, 'little'), dtype=np.uint8), bitorder='little')
+    twos = np.unpackbits(np.frombuffer(twos.to_bytes(size, 'little'), dtype=np.uint8), bitorder='little')
+    digits = (ones + 2*twos)[length - 1::-1] + ord('0')
+    return int(gmpy2.mpz(digits.tobytes().decode('ascii'), 3))
+
+
+class FLInt:
+    '''
+    An integer in ternary Frieder-Luk encoding. Addition and subtraction are
+    carry-less (digitwise mod 3), and shifts move whole trits, i.e. multiply
+    or floor-divide by powers of 3. Unpacks to the (ones, twos) pair used by
+    the free functions in this module.
+    '''
+    __slots__ = 'ones', 'twos'
     
-    out = 0
-    for digit in digits[::-1]:
-        out = 3*out + digit
-    return out
+    def __init__(self, ones=0, twos=0):
+        self.ones = ones
+        self.twos = twos
+    
+    @classmethod
+    def from_int(cls, n):
+        return cls(*to_fl(n))
+    
+    def __int__(self):
+        return from_fl((self.ones, self.twos))
+    
+    def __iter__(self):
+        yield self.ones
+        yield self.twos
+    
+    def __eq__(self, other):
+        if not isinstance(other, FLInt):
+            return NotImplemented
+        return self.ones == other.ones and self.twos == other.twos
+    
+    def __hash__(self):
+        return hash((self.ones, self.twos))
+    
+    def __bool__(self):
+        return self.ones != 0 or self.twos != 0
+    
+    def __add__(self, other):
+        return FLInt(*add_fl(self, other))
+    
+    def __neg__(self):
+        return FLInt(self.twos, self.ones)
+    
+    def __sub__(self, other):
+        return self + -other
+    
+    def __mul__(self, digit):
+        '''
+        Multiply every trit by a scalar mod 3.
+        '''
+        return [FLInt(), self, -self][digit % 3]
+    
+    __rmul__ = __mul__
+    
+    def __lshift__(self, trits):
+        return FLInt(self.ones << trits, self.twos << trits)
+    
+    def __rshift__(self, trits):
+        return FLInt(self.ones >> trits, self.twos >> trits)
+    
+    def __repr__(self):
+        return f'FLInt.from_int({int(self)})'
 
 
 def add_fl(a, b):
@@ -95,7 +157,130 @@ def powmod_fl(size, poly):
     return power
 
 
+def msequence_fl(size, poly):
+    '''
+    One period of the constant coefficient of x**i modulo x**size - poly over
+    GF(3), stepping by multiplication by x in Frieder-Luk encoding.
+    '''
+    ones_p, twos_p = poly
+    mask = (1 << size) - 1
+    ones, twos = 1, 0
+    sequence = []
+    for i in range(3**size - 1):
+        sequence.append((ones & 1) + 2*(twos & 1))
+        ones <<= 1
+        twos <<= 1
+        if ones & 1 << size:
+            ones, twos = add_fl((ones & mask, twos), (ones_p, twos_p))
+        elif twos & 1 << size:
+            ones, twos = add_fl((ones, twos & mask), (twos_p, ones_p))
+    return sequence
+
+
+def to_fl_many(ks, size):
+    '''
+    Frieder-Luk encodings of an array of integers below 3**size (which must
+    fit in an int64), as a pair of uint64 arrays.
+    '''
+    ks = np.asarray(ks, dtype=np.int64)
+    ones = np.zeros(ks.shape, dtype=np.uint64)
+    twos = np.zeros(ks.shape, dtype=np.uint64)
+    for i in range(size):
+        ks, digits = np.divmod(ks, 3)
+        ones |= (digits == 1).astype(np.uint64) << np.uint64(i)
+        twos |= (digits == 2).astype(np.uint64) << np.uint64(i)
+    return ones, twos
+
+
+def multmod_fl_many(size, poly, a, b):
+    '''
+    Vectorized `multmod_fl`: multiply `a` by `b` modulo x**size - poly for a
+    whole array of candidate polynomials at once, one per uint64 lane. All
+    arguments are (ones, twos) pairs of arrays (or scalars for `a` and `b`).
+    Requires size <= 62.
+    '''
+    ones_p, twos_p = poly
+    zero = np.uint64(0)
+    one = np.uint64(1)
+    top = np.uint64(size)
+    mask = (one << top) - one
+    ones_a, twos_a = (np.broadcast_to(np.asarray(c, dtype=np.uint64), ones_p.shape) for c in a)
+    ones_f, twos_f = (np.array(np.broadcast_to(np.asarray(c, dtype=np.uint64), ones_p.shape)) for c in b)
+    result = (np.zeros_like(ones_p), np.zeros_like(ones_p))
+    for i in range(size):
+        if_one = zero - (ones_a >> np.uint64(i) & one)
+        if_two = zero - (twos_a >> np.uint64(i) & one)
+        result = add_fl(result, (ones_f & if_one | twos_f & if_two,
+                                 twos_f & if_one | ones_f & if_two))
+        ones_f <<= one
+        twos_f <<= one
+        if_one = zero - (ones_f >> top & one)
+        if_two = zero - (twos_f >> top & one)
+        ones_f, twos_f = add_fl((ones_f & mask, twos_f & mask),
+                                (ones_p & if_one | twos_p & if_two,
+                                 twos_p & if_one | ones_p & if_two))
+    return result
+
+
+def powmod_fl_many(size, poly, n, e):
+    result = (np.ones_like(poly[0]), np.zeros_like(poly[0]))
+    for index in range(e.bit_length() - 1, -1, -1):
+        result = multmod_fl_many(size, poly, result, result)
+        if e >> index & 1:
+            result = multmod_fl_many(size, poly, n, result)
+    return result
+
+
+def primitive_fl_many(size, poly):
+    '''
+    Boolean mask of which candidates (a pair of plane arrays) are primitive.
+    '''
+    order = 3**size - 1
+    # With a single trit, x reduces to the constant poly.
+    x = (2, 0) if size > 1 else poly
+    ones, twos = powmod_fl_many(size, poly, x, order)
+    mask = (ones == 1) & (twos == 0)
+    for p in sympy.factorint(order):
+        ones, twos = powmod_fl_many(size, poly, x, order//p)
+        mask &= (ones != 1) | (twos != 0)
+    return mask
+
+
+def search_fl_many(size, which='all', chunk_size=2**14):
+    '''
+    Test every candidate with the vectorized engine, `chunk_size` at a time.
+    Candidates with a zero constant term are skipped.
+    '''
+    primitives = []
+    for start in range(0, 3**size, chunk_size):
+        ks = np.arange(start, min(start + chunk_size, 3**size), dtype=np.int64)
+        ks = ks[ks % 3 != 0]
+        found = ks[primitive_fl_many(size, to_fl_many(ks, size))].tolist()
+        primitives.extend(found)
+        if which == 'first' and len(primitives) > 0:
+            return primitives[:1]
+    return primitives
+
+
+def crosscheck_fl(size):
+    '''
+    Check the vectorized engine against `primitive_polynomials.polysearchp`.
+    '''
+    engine = search_fl_many(size)
+    reference = polysearchp(3, size)
+    assert engine == reference, f"Mismatch for size {size}"
+    return engine
+
+
 def polysearch_fl(size, which='all'):
+    if which == 'all':
+        found = polysearch_fl(size, 'first')
+        if len(found) == 0:
+            return []
+        return conjugate_search(3, size, msequence_fl(size, to_fl(found[0])))
+    if 3**size < 2**63:
+        return search_fl_many(size, which)
+    
     order = 3**size - 1
     factors = [order//p for p in sympy.factorint(order)]
     
@@ -184,3 +369,65 @@ def add_dfl(a, b):
 
 def add_no_carry(m, n):
     return from_dfl(add_dfl(to_dfl(m), to_dfl(n)))
+
+
+# Conversion tables for chunks of four decimal digits: row k of
+# `dfl_chunk_planes` gives the bit plane for bit k of each value below 10**4,
+# and `dfl_chunk_values` gives the value for each pattern of four 4-bit
+# planes, packed as (ones | twos << 4 | fours << 8 | eights << 12).
+dfl_chunk_digits = 4
+dfl_chunk_base = 10**dfl_chunk_digits
+dfl_digits = np.arange(dfl_chunk_base) // 10**np.arange(dfl_chunk_digits)[:, None] % 10
+dfl_chunk_planes = np.array([
+    ((dfl_digits >> k & 1) << np.arange(dfl_chunk_digits)[:, None]).sum(axis=0)
+    for k in range(4)
+], dtype=np.uint32)
+dfl_patterns = np.arange(1 << 4*dfl_chunk_digits)
+dfl_chunk_values = sum(
+    ((dfl_patterns >> (4*k + i) & 1).astype(np.uint64) << np.uint64(k)) * np.uint64(10**i)
+    for k in range(4) for i in range(dfl_chunk_digits)
+)
+
+
+def to_dfl_many(ns):
+    '''
+    Calculate the decimal Frieder-Luk encodings of an array of integers below
+    10**19 at once. Returns four arrays of bit planes, one per bit of each
+    decimal digit, as `to_dfl` does for a single integer.
+    '''
+    ns = np.asarray(ns, dtype=np.uint64)
+    planes = [np.zeros(ns.shape, dtype=np.uint32) for k in range(4)]
+    base = np.uint64(dfl_chunk_base)
+    for shift in range(0, 20, dfl_chunk_digits):
+        ns, chunks = np.divmod(ns, base)
+        chunks = chunks.astype(np.intp)
+        for k in range(4):
+            planes[k] |= dfl_chunk_planes[k][chunks] << np.uint32(shift)
+    return tuple(planes)
+
+
+def from_dfl_many(quad):
+    '''
+    Given four arrays of bit planes constituting decimal Frieder-Luk encodings,
+    determine the corresponding array of integers.
+    '''
+    planes = [np.asarray(plane, dtype=np.uint32) for plane in quad]
+    out = np.zeros(np.broadcast(*planes).shape, dtype=np.uint64)
+    width = int(np.bitwise_or.reduce([plane.max(initial=0) for plane in planes])).bit_length()
+    base = np.uint64(dfl_chunk_base)
+    mask = np.uint32(2**dfl_chunk_digits - 1)
+    for shift in reversed(range(0, width, dfl_chunk_digits)):
+        patterns = sum(
+            (planes[k] >> np.uint32(shift) & mask).astype(np.intp) << 4*k
+            for k in range(4)
+        )
+        out = out*base + dfl_chunk_values[patterns]
+    return out
+
+
+def add_no_carry_many(ms, ns):
+    '''
+    Add two arrays of integers digitwise without carrying, by running
+    `add_dfl` across the whole arrays of bit planes at once.
+    '''
+    return from_dfl_many(add_dfl(to_dfl_many(ms), to_dfl_many(ns)))
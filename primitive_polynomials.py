@@ -1,23 +1,103 @@
 import sympy
 import itertools
 import math
+import os
+import numpy as np
+import yaml
 
-def multmod(size, poly):
+def clmul(n, m):
+    '''
+    Carry-less product of two integers, i.e. their product as GF(2)
+    polynomials.
+    '''
+    p = 0
+    while n != 0:
+        if n & 1:
+            p ^= m
+        n >>= 1
+        m <<= 1
+    return p
+
+
+def multmod(size, poly, window=4):
+    '''
+    Multiplication modulo x**size + poly over GF(2), `window` bits at a time.
+    Each product builds a table of the carry-less multiples of `m` by every
+    `window`-bit value, and the high part is reduced `window` bits at a time
+    from a table of multiples of the modulus indexed by their top bits.
+    '''
+    full = 1 << size | poly
+    low_mask = (1 << size) - 1
+    window_mask = (1 << window) - 1
+    reduction = [0] * (1 << window)
+    for q in range(1 << window):
+        r = clmul(q, full)
+        reduction[r >> size] = r
+    shifts = range(0, size, window)
+    reduce_shifts = range((size - 2)//window*window, -1, -window)
     
     def product(n, m):
+        n &= low_mask
+        multiples = [0] * (1 << window)
+        for j in range(1, 1 << window):
+            multiples[j] = multiples[j >> 1] << 1 ^ (m if j & 1 else 0)
         p = 0
-        factor = m
-        for i in range(size):
-            bit = (n & 2**i) // 2**i
-            p ^= bit * factor % 2**size
-            factor = factor << 1
-            if factor & 2**size != 0:
-                factor ^= poly
+        for shift in shifts:
+            p ^= multiples[n >> shift & window_mask] << shift
+        for shift in reduce_shifts:
+            p ^= reduction[p >> (size + shift) & window_mask] << shift
         return p
     
     return product
 
 
+def multmod_many(size, polys, a, b):
+    '''
+    Multiply `a` by `b` modulo x**size + polys over GF(2), for a whole array
+    of candidate polynomials at once: each uint64 lane holds one candidate
+    and the corresponding field elements. Requires size <= 62.
+    '''
+    one = np.uint64(1)
+    top = np.uint64(size)
+    low_mask = (one << top) - one
+    a = np.broadcast_to(np.asarray(a, dtype=np.uint64), polys.shape)
+    b = np.array(np.broadcast_to(np.asarray(b, dtype=np.uint64), polys.shape))
+    result = np.zeros_like(polys)
+    for i in range(size):
+        bit = a >> np.uint64(i) & one
+        result ^= b & (np.uint64(0) - bit)
+        b <<= one
+        overflow = b >> top & one
+        b = b & low_mask ^ polys & (np.uint64(0) - overflow)
+    return result
+
+
+def powmod_many(size, polys, n, e):
+    '''
+    Raise `n` to the power `e` modulo each of `polys`, as in `multmod_many`.
+    '''
+    result = np.ones_like(polys)
+    for index in range(e.bit_length() - 1, -1, -1):
+        result = multmod_many(size, polys, result, result)
+        if e >> index & 1:
+            result = multmod_many(size, polys, n, result)
+    return result
+
+
+def primitive_many(size, polys):
+    '''
+    Boolean mask of which x**size + k, for k in `polys`, are primitive,
+    i.e. x has order exactly 2**size - 1.
+    '''
+    order = 2**size - 1
+    # With a single bit, x reduces to the constant poly.
+    x = 2 if size > 1 else polys
+    mask = powmod_many(size, polys, x, order) == 1
+    for p in sympy.factorint(order):
+        mask &= powmod_many(size, polys, x, order//p) != 1
+    return mask
+
+
 def powmod(size, poly):
     product = multmod(size, poly)
     
@@ -40,100 +120,481 @@ def all_factors(n):
     return sorted(math.prod(l) for l in itertools.product(*prime_powers))
 
 
-def polysearch(size, which='all'):
+def polysearch(size, which='all', jobs=1):
+    if which == 'all':
+        found = search(size, 'first', jobs)
+        if len(found) == 0:
+            return []
+        return conjugate_search(2, size, msequence(size, found[0]))
+    return search(size, which, jobs)
+
+
+def is_primitive(size, poly):
+    factors = all_factors(2**size - 1)
+    power = powmod(size, poly)
+    powers = [power(2, f) for f in factors]
+    return powers[-1] == 1 and all(p != 1 for p in powers[:-1])
+
+
+def gf2_mod(a, b):
+    '''
+    Remainder of the GF(2) polynomial `a` on division by `b`, both given as
+    integers whose bits are the coefficients.
+    '''
+    degree = b.bit_length()
+    while a.bit_length() >= degree:
+        a ^= b << (a.bit_length() - degree)
+    return a
+
+
+def gf2_gcd(a, b):
+    while b != 0:
+        a, b = b, gf2_mod(a, b)
+    return a
+
+
+def is_irreducible(size, poly):
+    '''
+    Rabin's test for irreducibility of x**size + poly over GF(2):
+    x**(2**size) = x modulo the polynomial, and x**(2**(size//q)) - x is
+    coprime to it for every prime q dividing size.
+    '''
+    product = multmod(size, poly)
+    full = 1 << size | poly
+    squares = [2]
+    for i in range(size):
+        squares.append(product(squares[-1], squares[-1]))
+    if squares[size] != 2:
+        return False
+    return all(gf2_gcd(full, squares[size//q] ^ 2) == 1
+               for q in sympy.factorint(size))
+
+
+def gf2_gcd_many(a, b):
+    '''
+    Lane-wise GCD of GF(2) polynomials held in uint64 arrays, by the binary
+    GCD algorithm. Every lane of `a` must have constant term 1.
+    '''
+    one = np.uint64(1)
+    a = np.array(a, dtype=np.uint64)
+    b = np.array(b, dtype=np.uint64)
+    while True:
+        active = b != 0
+        if not np.any(active):
+            return a
+        # Factors of x in b are not shared with a, so drop them; otherwise
+        # both have constant term 1 and the larger becomes their sum.
+        even = active & (b & one == 0)
+        b[even] >>= one
+        odd = active & ~even
+        low = np.minimum(a[odd], b[odd])
+        b[odd] ^= a[odd]
+        a[odd] = low
+
+
+def is_irreducible_many(size, polys):
+    '''
+    Boolean mask of which x**size + k, for k in `polys`, pass Rabin's test
+    (see `is_irreducible`), one uint64 lane per candidate. Requires
+    size <= 62.
+    '''
+    checks = {size//q for q in sympy.factorint(size)}
+    # With a single bit, x reduces to the constant poly.
+    x = np.uint64(2) if size > 1 else polys
+    squares = np.array(np.broadcast_to(x, polys.shape), dtype=np.uint64)
+    saved = []
+    for i in range(1, size + 1):
+        squares = multmod_many(size, polys, squares, squares)
+        if i in checks:
+            saved.append(squares)
+    mask = squares == x
+    full = polys | np.uint64(1) << np.uint64(size)
+    for power in saved:
+        mask &= gf2_gcd_many(full, power ^ x) == 1
+    return mask
+
+
+def sieve(size, start, stop):
+    '''
+    Candidates in range(start, stop) that survive the cheap checks: the
+    constant term must be 1 (or x divides the polynomial) and the number
+    of terms must be odd (or x + 1 divides it, unless it is x + 1).
+    '''
+    for k in range(start | 1, stop, 2):
+        if bin(k).count('1') % 2 == 0 or size == 1:
+            yield k
+
+
+def search_shard(size, start, stop, which='all'):
+    if size <= 62:
+        candidates = np.fromiter(sieve(size, start, stop), dtype=np.uint64)
+        candidates = candidates[is_irreducible_many(size, candidates)]
+        primitives = candidates[primitive_many(size, candidates)].tolist()
+        return primitives[:1] if which == 'first' else primitives
+    
     order = 2**size - 1
     factors = [order//p for p in sympy.factorint(order)]
     
     primitives = []
-    for k in range(2**size):
+    for k in sieve(size, start, stop):
+        if not is_irreducible(size, k):
+            continue
         power = powmod(size, k)
-        powers = [power(2, f) for f in factors]
-        if power(2, order) == 1 and all(q != 1 for q in powers):
+        if power(2, order) == 1 and all(power(2, f) != 1 for f in factors):
             primitives.append(k)
             if which == 'first':
                 break
-    
     return primitives
 
 
-def is_primitive(size, poly):
-    factors = all_factors(2**size - 1)
-    power = powmod(size, poly)
-    powers = [power(2, f) for f in factors]
-    return powers[-1] == 1 and all(p != 1 for p in powers[:-1])
+def search_task(task):
+    return search_shard(*task)
 
 
-def addmodp(p, size):
+def load_yaml(filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return yaml.safe_load(f) or {}
+
+
+def dump_yaml(data, filename):
+    with open(filename + '.tmp', 'w') as f:
+        yaml.safe_dump(data, f, default_flow_style=False)
+    os.replace(filename + '.tmp', filename)
+
+
+def load_progress(filename):
+    '''
+    Read a search progress log, as written by `search`: one line per finished
+    shard, mapping the end of the shard to the primitives found in it.
+    Returns the end of the last finished shard and all primitives found so
+    far. A line cut short by an interruption is cut from the file.
+    '''
+    done = 0
+    primitives = []
+    if os.path.exists(filename):
+        with open(filename, 'r+') as f:
+            for line in iter(f.readline, ''):
+                try:
+                    (end, found), = yaml.safe_load(line).items()
+                    assert line.endswith('\n')
+                except (yaml.YAMLError, AttributeError, ValueError, AssertionError):
+                    f.seek(f.tell() - len(line.encode()))
+                    f.truncate()
+                    break
+                done = end
+                primitives.extend(found)
+    return done, primitives
+
+
+def search(size, which='all', jobs=1, shard_size=2**12, checkpoint=None):
+    '''
+    Find primitive polynomials x**size + k over GF(2), returning the k.
+    Candidates are sieved (see `sieve` and `is_irreducible`) before the full
+    order test, and the candidate space is split into shards of `shard_size`
+    that are spread over `jobs` processes.
     
-    def add(n, m):
-        result = 0
-        for i in range(size-1, -1, -1):
-            digit_n = n // p**i % p
-            digit_m = m // p**i % p
-            digit_r = (digit_n + digit_m) % p
-            result = p*result + digit_r
-        return result
+    If `checkpoint` names a YAML file (e.g. all-primitive-polynomials.yml),
+    each finished shard is appended to a `.partial-<size>.yml` log beside it,
+    from which an interrupted search resumes. When the search finishes,
+    the results are stored in `checkpoint` under `size` and the log is
+    removed.
+    '''
+    progress = None
+    done = 0
+    primitives = []
+    if checkpoint is not None and which == 'all':
+        progress_file = os.path.splitext(checkpoint)[0] + f'.partial-{size}.yml'
+        done, primitives = load_progress(progress_file)
+        progress = open(progress_file, 'a')
+    # Shards are handed out in small batches, so that the candidate space is
+    # never materialised and a 'first' search stops soon after a hit.
+    todo = ((size, start, min(start + shard_size, 2**size), which)
+            for start in range(done, 2**size, shard_size))
     
-    return add
+    if jobs == 1:
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+    try:
+        while True:
+            batch = list(itertools.islice(todo, 4*jobs))
+            if len(batch) == 0:
+                break
+            results = map(search_task, batch) if pool is None else pool.map(search_task, batch)
+            for shard, found in zip(batch, results):
+                primitives.extend(found)
+                if which == 'first' and len(found) > 0:
+                    break
+                if progress is not None:
+                    progress.write(f'{shard[2]}: {found}\n')
+            if progress is not None:
+                progress.flush()
+            if which == 'first' and len(primitives) > 0:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if progress is not None:
+            progress.close()
+    
+    primitives = sorted(primitives)
+    if progress is not None:
+        data = load_yaml(checkpoint)
+        data[size] = primitives
+        dump_yaml(data, checkpoint)
+        os.remove(progress_file)
+    return primitives
 
 
-def scalarmult(p, size):
+def berlekamp_massey(sequence, p):
+    '''
+    Find the shortest linear recurrence over GF(p) generating `sequence`.
+    Returns the coefficients [1, c_1, ..., c_L] of the connection polynomial,
+    so that s[i] + c_1*s[i-1] + ... + c_L*s[i-L] = 0 (mod p).
+    '''
+    current, previous = [1], [1]
+    length = 0
+    shift = 1
+    last_discrepancy = 1
+    for n in range(len(sequence)):
+        discrepancy = sequence[n]
+        for i in range(1, length + 1):
+            discrepancy += current[i]*sequence[n - i]
+        discrepancy %= p
+        if discrepancy == 0:
+            shift += 1
+            continue
+        coeff = discrepancy * pow(last_discrepancy, p - 2, p) % p
+        saved = current[:]
+        current = current + [0]*(len(previous) + shift - len(current))
+        for i, c in enumerate(previous):
+            current[i + shift] = (current[i + shift] - coeff*c) % p
+        if 2*length <= n:
+            length = n + 1 - length
+            previous = saved
+            last_discrepancy = discrepancy
+            shift = 1
+        else:
+            shift += 1
+    return (current + [0]*(length + 1))[:length + 1]
+
+
+def msequence(size, poly):
+    '''
+    One period of the constant coefficient of x**i modulo x**size + poly over
+    GF(2). For a primitive polynomial this is a maximal-length sequence.
+    '''
+    full = 1 << size | poly
+    a = 1
+    sequence = []
+    for i in range(2**size - 1):
+        sequence.append(a & 1)
+        a <<= 1
+        if a >> size & 1:
+            a ^= full
+    return sequence
+
+
+def conjugate_search(p, size, sequence):
+    '''
+    Enumerate all primitive polynomials of degree `size` over GF(p), given
+    one period of a maximal-length sequence s[i] = L(alpha**i) from a single
+    primitive polynomial. The primitive elements are the alpha**k with k
+    coprime to p**size - 1; conjugates alpha**(k*p**j) share a minimal
+    polynomial, so each Frobenius orbit is visited once. The minimal
+    polynomial of alpha**k is recovered by Berlekamp-Massey from the
+    decimated sequence s[k*i]. Results use the same encoding as
+    `polysearchp`, where x**size reduces to +poly.
+    '''
+    order = p**size - 1
+    visited = bytearray(order)
+    primitives = []
+    # k = 0 is only coprime to the order when the order is 1, in which case
+    # alpha itself is 1.
+    for k in range(order):
+        if visited[k] or math.gcd(k, order) != 1:
+            continue
+        j = k
+        while not visited[j]:
+            visited[j] = 1
+            j = j*p % order
+        decimated = [int(sequence[k*i % order]) for i in range(2*size)]
+        connection = berlekamp_massey(decimated, p)
+        primitives.append(sum(-connection[size - i] % p * p**i for i in range(size)))
+    return sorted(primitives)
+
+
+class FiniteField:
+    '''
+    Arithmetic in GF(p)[x] / (x**size - poly), with elements encoded as
+    integers whose base-p digits are their coefficients, constant term
+    first (the encoding used by `multmodp`). When x generates the
+    multiplicative group and there are at most `table_limit` elements,
+    multiplication, inverses and powers are lookups in log/antilog tables;
+    otherwise they work on NumPy digit vectors, so `poly` need not be
+    primitive (or even irreducible) in that case.
+    '''
+    __slots__ = 'p', 'size', 'poly', 'order', 'weights', 'poly_digits', 'log', 'antilog'
     
-    def scalarprod(d, n):
-        result = 0
-        for i in range(size-1, -1, -1):
-            digit_n = n // p**i % p
-            digit_r = d * digit_n % p
-            result = p*result + digit_r
-        return result
+    def __init__(self, p, size, poly, table_limit=2**20):
+        self.p = p
+        self.size = size
+        self.poly = poly
+        self.order = p**size - 1
+        self.weights = [p**i for i in range(size)]
+        self.poly_digits = self.to_digits(poly)
+        self.log = None
+        self.antilog = None
+        if p**size <= table_limit:
+            self.build_tables()
+    
+    def to_digits(self, n):
+        return np.array([n // w % self.p for w in self.weights], dtype=np.int64)
+    
+    def from_digits(self, digits):
+        return sum(int(d)*w for d, w in zip(digits, self.weights))
+    
+    def mul_digits(self, a, b):
+        c = np.convolve(a, b)
+        for i in range(len(c) - 1, self.size - 1, -1):
+            lead = c[i] % self.p
+            if lead != 0:
+                c[i-self.size:i] += lead * self.poly_digits
+        return c[:self.size] % self.p
+    
+    def build_tables(self):
+        '''
+        Build the antilog table x**i for i < order by doubling: once the rows
+        x**i for i < B are known, the next B rows are those times x**B, which
+        is a single matrix product over GF(p). If x turns out not to generate
+        the whole group, no tables are kept.
+        '''
+        p, size = self.p, self.size
+        digits = np.zeros((1, size), dtype=np.int64)
+        digits[0, 0] = 1
+        # With a single digit, x reduces to the constant poly.
+        x = self.to_digits(p if size > 1 else self.poly)
+        while len(digits) < self.order:
+            x_b = self.mul_digits(digits[-1], x)
+            matrix = np.array([self.mul_digits(x_b, row) for row in np.eye(size, dtype=np.int64)])
+            digits = np.concatenate([digits, digits @ matrix % p])
+        antilog = (digits[:self.order] @ np.array(self.weights, dtype=np.int64)).tolist()
+        if len(set(antilog)) != self.order or 0 in antilog:
+            return
+        log = [0] * (self.order + 1)
+        for i, a in enumerate(antilog):
+            log[a] = i
+        self.log = log
+        self.antilog = antilog
+    
+    def msequence(self, block_size=2**12):
+        '''
+        One period of the constant coefficient of x**i, as a NumPy array.
+        For a primitive polynomial this is a maximal-length sequence. The
+        powers of x are generated `block_size` at a time, each block being
+        the previous one times x**block_size, so memory stays bounded by the
+        block rather than the whole antilog table.
+        '''
+        p, size = self.p, self.size
+        # With a single digit, x reduces to the constant poly.
+        x = self.to_digits(p if size > 1 else self.poly)
+        rows = [self.to_digits(1)]
+        while len(rows) < min(block_size, self.order):
+            rows.append(self.mul_digits(rows[-1], x))
+        block = np.array(rows)
+        x_b = self.mul_digits(block[-1], x)
+        matrix = np.array([self.mul_digits(x_b, row) for row in np.eye(size, dtype=np.int64)])
+        sequence = np.zeros(self.order, dtype=np.int64)
+        for start in range(0, self.order, len(block)):
+            sequence[start:start + len(block)] = block[:self.order - start, 0]
+            block = block @ matrix % p
+        return sequence
+    
+    def add(self, a, b):
+        if self.p == 2:
+            return (a ^ b) & self.order
+        return self.from_digits((self.to_digits(a) + self.to_digits(b)) % self.p)
+    
+    def neg(self, a):
+        return self.from_digits(-self.to_digits(a) % self.p)
+    
+    def sub(self, a, b):
+        return self.add(a, self.neg(b))
+    
+    def scalar(self, d, a):
+        return self.from_digits(d * self.to_digits(a) % self.p)
+    
+    def mul(self, a, b):
+        if self.log is not None:
+            if a == 0 or b == 0:
+                return 0
+            return self.antilog[(self.log[a] + self.log[b]) % self.order]
+        return self.from_digits(self.mul_digits(self.to_digits(a), self.to_digits(b)))
+    
+    def power(self, a, e):
+        if self.log is not None:
+            if a == 0:
+                return 0 if e > 0 else 1
+            return self.antilog[self.log[a] * e % self.order]
+        base = self.to_digits(a)
+        result = self.to_digits(1)
+        for index in range(e.bit_length() - 1, -1, -1):
+            result = self.mul_digits(result, result)
+            if e >> index & 1:
+                result = self.mul_digits(base, result)
+        return self.from_digits(result)
     
-    return scalarprod
+    def inverse(self, a):
+        if a == 0:
+            raise ZeroDivisionError("0 has no inverse")
+        if self.log is not None:
+            return self.antilog[-self.log[a] % self.order]
+        return self.power(a, self.order - 1)
+    
+    def is_primitive(self):
+        '''
+        Whether x has multiplicative order p**size - 1.
+        '''
+        if self.log is not None:
+            return True
+        x = self.p if self.size > 1 else self.poly
+        return (self.power(x, self.order) == 1
+                and all(self.power(x, self.order//q) != 1 for q in sympy.factorint(self.order)))
+
+
+def addmodp(p, size):
+    return FiniteField(p, size, 0, table_limit=0).add
+
+
+def scalarmult(p, size):
+    return FiniteField(p, size, 0, table_limit=0).scalar
 
 
 def multmodp(p, size, poly):
-    add = addmodp(p, size)
-    scalarprod = scalarmult(p, size)
-    
-    def product(n, m):
-        result = 0
-        factor = m
-        for i in range(size):
-            digit_n = n // p**i % p
-            result = add(result, scalarprod(digit_n, factor))
-            factor = p*factor
-            leading_coeff = factor // p**size % p
-            factor = factor % p**size
-            if leading_coeff != 0:
-                factor = add(factor, scalarprod(leading_coeff, poly))
-        return result
-    
-    return product
+    return FiniteField(p, size, poly, table_limit=0).mul
 
 
 def powmodp(p, size, poly):
-    product = multmodp(p, size, poly)
-    
-    def power(n, e):
-        index = e.bit_length() - 1
-        result = 1
-        while index >= 0:
-            result = product(result, result)
-            if e & 2**index != 0:
-                result = product(n, result)
-            index -= 1
-        return result
-    
-    return power
+    return FiniteField(p, size, poly, table_limit=0).power
 
 
 def polysearchp(p, size, which='all'):
-    factors = all_factors(p**size - 1)
+    if which == 'all':
+        found = polysearchp(p, size, 'first')
+        if len(found) == 0:
+            return []
+        field = FiniteField(p, size, found[0], table_limit=0)
+        return conjugate_search(p, size, field.msequence())
     
     primitives = []
     for k in range(p**size):
-        power = powmodp(p, size, k)
-        powers = [power(p, f) for f in factors]
-        if powers[-1] == 1 and all(q != 1 for q in powers[:-1]):
+        # A zero constant term means x divides the polynomial.
+        if k % p == 0:
+            continue
+        if FiniteField(p, size, k, table_limit=0).is_primitive():
             primitives.append(k)
             if which == 'first':
                 break
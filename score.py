@@ -15,16 +15,72 @@ def ind(c):
 
 def score_freq(cryptogram):
     score = 0
-    for c in word:
+    for c in cryptogram:
         if c in freq_scores:
             score += freq_scores[c]
     return score
 
+def indices(text):
+    '''
+    Map a text to an array of `ind` values, all characters at once.
+    '''
+    codes = np.frombuffer(text.upper().encode('utf-32-le'), dtype=np.uint32)
+    codes = codes.astype(np.intp) - 64
+    codes[codes == ord(' ') - 64] = 0
+    return codes
+
+def score_indices(inds):
+    '''
+    Markov score of an array of `ind` values. A 2-D array is treated as a
+    batch of equal-length texts, one per row, and gives one score per row.
+    '''
+    inds = np.asarray(inds, dtype=np.intp)
+    prev = np.zeros(inds.shape[:-1] + (inds.shape[-1] + 1,), dtype=np.intp)
+    prev[..., 1:] = inds
+    return (markov_scores[inds, prev[..., :-1]].sum(axis=-1)
+            + markov_scores[prev[..., -1], 0])
+
 def score_markov(word):
-    score = 0
-    prev = 0
-    for c in word:
-        score += markov_scores[ind(c), prev]
-        prev = ind(c)
-    score += markov_scores[prev, 0]
-    return score
+    return score_indices(indices(word))
+
+def score_markov_many(words):
+    '''
+    Score a batch of equal-length texts in one call. `words` is either a
+    sequence of strings or a 2-D array of `ind` values.
+    '''
+    if len(words) == 0:
+        return np.zeros(0)
+    if isinstance(words[0], str):
+        words = [indices(word) for word in words]
+    return score_indices(np.asarray(words, dtype=np.intp).reshape(len(words), -1))
+
+# Transition counts are kept over every index `ind` can produce, -27 to 26,
+# offset by 27, so that characters outside the alphabet keep their own slots
+# when the letters are permuted.
+slots = 54
+identity_mapping = np.arange(slots) - 27
+
+def transition_counts(text):
+    '''
+    Reduce a text to a matrix of (cur, prev) transition counts over `ind`
+    slots, along with the slot of its last character. Together these
+    determine the Markov score of any monoalphabetic decryption of the text.
+    '''
+    inds = indices(text) + 27
+    prev = np.empty_like(inds)
+    prev[:1] = 27
+    prev[1:] = inds[:-1]
+    counts = np.bincount(slots*inds + prev, minlength=slots*slots)
+    last = inds[-1] if len(inds) > 0 else 27
+    return counts.reshape(slots, slots), last
+
+def score_counts(counts, last, mapping=identity_mapping):
+    '''
+    Markov score of a text given its transition counts, after each slot is
+    replaced by `mapping[slot]`. A 2-D `mapping` scores one substitution per
+    row.
+    '''
+    mapping = np.asarray(mapping)
+    cur, prev = np.nonzero(counts)
+    return ((counts[cur, prev] * markov_scores[mapping[..., cur], mapping[..., prev]]).sum(axis=-1)
+            + markov_scores[mapping[..., last], 0])